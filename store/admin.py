@@ -3,7 +3,6 @@ from django.contrib.admin.filters import SimpleListFilter
 from django.contrib.admin.views.main import ChangeList
 from django.contrib.contenttypes.admin import GenericTabularInline
 from django.db import models
-from django.db.models.aggregates import Count
 from django.db.models.expressions import OrderBy
 from django.db.models.query import QuerySet
 from django.http.request import HttpRequest
@@ -12,7 +11,7 @@ from django.urls.base import clear_url_caches
 from django.utils.html import format_html, urlencode
 from typing_extensions import OrderedDict
 
-from . import models
+from . import cache, models, orders
 
 # Register your models here.
 
@@ -25,32 +24,33 @@ class UnorderedChangeList(ChangeList):
 @admin.register(models.Collection)
 class CollectionAdmin(admin.ModelAdmin):
 
-    list_display = ["title", "product_count"]
+    list_display = ["title", "products_count"]
     search_fields = ["title"]
     autocomplete_fields = ["featured_product"]
 
-    @admin.display(ordering="product_count")
-    def product_count(self, collection):
+    @admin.display(ordering="products_count")
+    def products_count(self, collection):
         url = (
             reverse("admin:store_product_changelist")
             + "?"
             + urlencode({"collection__id": str(collection.id)})
         )
-        return format_html("<a href={}>{} Products</>", url, collection.product_count)
+        return format_html("<a href={}>{} Products</>", url, collection.products_count)
 
     def get_queryset(self, request):
-        print(request)
-        return (
-            super()
-            .get_queryset(request)
-            .annotate(product_count=Count("products"))
-            .order_by("-product_count")
-        )
+        return super().get_queryset(request).order_by("-products_count")
 
     def get_changelist(self, request, **kwargs):
         return UnorderedChangeList
 
 
+@admin.register(models.TaxRate)
+class TaxRateAdmin(admin.ModelAdmin):
+    list_display = ["collection", "rate"]
+    list_select_related = ["collection"]
+    autocomplete_fields = ["collection"]
+
+
 class InventoryFilter(admin.SimpleListFilter):
     title = "inventory"
     parameter_name = "inventory"
@@ -69,8 +69,14 @@ class ProductImageInline(admin.TabularInline):
 
     def thumbnail(self, instance: models.ProductImage):
         if not instance.image.url == "":
+            thumbnail = instance.variants.get("thumbnail", {}).get("jpg")
+            src = (
+                instance.image.storage.url(thumbnail)
+                if thumbnail
+                else instance.image.url
+            )
             return format_html(
-                f'<a href={instance.image.url}><img src={instance.image.url} class="thumbnail"/></a>'
+                f'<a href={instance.image.url}><img src={src} class="thumbnail"/></a>'
             )
         return ""
 
@@ -110,6 +116,8 @@ class ProdutAdmin(admin.ModelAdmin):
     @admin.action(description="Clear Inventory")
     def clear_inventory(self, request, queryset):
         updated_count = queryset.update(inventory=0)
+        # update() bypasses post_save, so the catalog cache is not invalidated by signals
+        cache.invalidate(cache.CATALOG)
         self.message_user(
             request, f"{updated_count} successfully updated.", messages.ERROR
         )
@@ -118,10 +126,34 @@ class ProdutAdmin(admin.ModelAdmin):
         css = {"all": ["store/styles.css"]}
 
 
+class OrderCountFilter(admin.SimpleListFilter):
+    title = "orders"
+    parameter_name = "orders"
+
+    def lookups(self, request, model_admin):
+        return [("0", "None"), ("1-5", "1 to 5"), (">5", "More than 5")]
+
+    def queryset(self, request, queryset: QuerySet):
+        if self.value() == "0":
+            return queryset.filter(order_count=0)
+        if self.value() == "1-5":
+            return queryset.filter(order_count__range=(1, 5))
+        if self.value() == ">5":
+            return queryset.filter(order_count__gt=5)
+
+
 @admin.register(models.Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    list_display = ["first_name", "last_name", "membership", "order_count"]
+    list_display = [
+        "first_name",
+        "last_name",
+        "membership",
+        "order_count",
+        "lifetime_spend",
+        "last_order_at",
+    ]
     list_editable = ["membership"]
+    list_filter = ["membership", OrderCountFilter]
     list_per_page = 10
     list_select_related = ["user"]
     ordering = ["user__first_name", "user__last_name"]
@@ -140,9 +172,6 @@ class CustomerAdmin(admin.ModelAdmin):
         )
         return format_html("<a href={}>{} Orders</>", url, customer.order_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(order_count=Count("order"))
-
 
 # admin.site.register(models.Product, ProdutAdmin)
 
@@ -159,4 +188,19 @@ class OrderItemInline(admin.TabularInline):
 class OrderAdmin(admin.ModelAdmin):
     autocomplete_fields = ["customer"]
     inlines = [OrderItemInline]
-    list_display = ["id", "placed_at", "customer", "payment_status"]
+    list_display = [
+        "id",
+        "placed_at",
+        "customer",
+        "payment_status",
+        "item_count",
+        "total_price",
+    ]
+    readonly_fields = ["item_count", "total_price"]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        orders.refresh_totals(models.Order.objects.filter(pk=form.instance.pk))
+        orders.refresh_customer_stats(
+            models.Customer.objects.filter(pk=form.instance.customer_id)
+        )
@@ -0,0 +1,185 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.utils import timezone
+
+from store.cache import invalidate
+from store.models import (
+    ArchivedOrderItem,
+    BestSeller,
+    CollectionDailySales,
+    OrderItem,
+    ProductDailySales,
+)
+
+"""
+Daily sales rollups behind the staff analytics API.
+
+record_order() adds each new order to ProductDailySales and
+CollectionDailySales once checkout commits (see the order_created handler),
+so busy rollup rows are never locked for the length of a checkout.
+reconcile() recomputes whole days from the order items (hot and archived)
+and runs nightly to repair anything the increments missed, such as admin
+edits or deleted orders. Days are in the current time zone.
+
+BestSeller holds the top STORE_BEST_SELLERS_SIZE products per window in
+STORE_BEST_SELLER_WINDOWS, overall and per collection. refresh_best_sellers()
+rebuilds it from ProductDailySales every few minutes; in between,
+record_order() adds new sales to products already ranked, and products
+that break into the top k show up at the next refresh.
+"""
+
+BEST_SELLERS = "best-sellers"
+
+
+def _increment(model, key, units, revenue, orders):
+    values = {
+        "units": F("units") + units,
+        "revenue": F("revenue") + revenue,
+        "orders": F("orders") + orders,
+    }
+    if model.objects.filter(**key).update(**values):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, units=units, revenue=revenue, orders=orders)
+    except IntegrityError:
+        # a concurrent order created the row first
+        model.objects.filter(**key).update(**values)
+
+
+def record_order(order):
+    date = timezone.localdate(order.placed_at)
+    products = defaultdict(lambda: [0, Decimal(0)])
+    collections = defaultdict(lambda: [0, Decimal(0)])
+    for item in order.items.select_related("product"):
+        revenue = item.quantity * item.unit_price
+        for totals in [
+            products[item.product_id],
+            collections[item.product.collection_id],
+        ]:
+            totals[0] += item.quantity
+            totals[1] += revenue
+    # in id order, so concurrent checkouts lock rollup rows in the same order
+    for product_id, (units, revenue) in sorted(products.items()):
+        _increment(
+            ProductDailySales,
+            {"product_id": product_id, "date": date},
+            units,
+            revenue,
+            1,
+        )
+    for collection_id, (units, revenue) in sorted(collections.items()):
+        _increment(
+            CollectionDailySales,
+            {"collection_id": collection_id, "date": date},
+            units,
+            revenue,
+            1,
+        )
+    for product_id, (units, revenue) in sorted(products.items()):
+        BestSeller.objects.filter(product_id=product_id).update(
+            units=F("units") + units, revenue=F("revenue") + revenue
+        )
+
+
+def _day_totals(item_model, group_by, date):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(date + timedelta(days=1), time.min), tz)
+    return (
+        item_model.objects.filter(order__placed_at__gte=start, order__placed_at__lt=end)
+        .values(group_by)
+        .annotate(
+            units=Sum("quantity"),
+            revenue=Sum(
+                F("quantity") * F("unit_price"),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            orders=Count("order", distinct=True),
+        )
+        .order_by()
+    )
+
+
+def _rebuild(model, key, group_by, date):
+    rows = {}
+    # an order is either hot or archived, never both, so the sums just add up
+    for item_model in [OrderItem, ArchivedOrderItem]:
+        for row in _day_totals(item_model, group_by, date):
+            total = rows.setdefault(
+                row[group_by], {"units": 0, "revenue": Decimal(0), "orders": 0}
+            )
+            for field in total:
+                total[field] += row[field]
+    model.objects.filter(date=date).delete()
+    model.objects.bulk_create(
+        model(**{key: group, "date": date}, **totals) for group, totals in rows.items()
+    )
+    return len(rows)
+
+
+def reconcile(days=2, until=None):
+    """
+    Recomputes the rollups of the days days up to until, yesterday by
+    default: today's rows are still being incremented by checkouts. Each day
+    is rebuilt in its own transaction. Returns the rows written per table.
+    """
+    until = until or timezone.localdate() - timedelta(days=1)
+    written = {"products": 0, "collections": 0}
+    for offset in range(days):
+        date = until - timedelta(days=offset)
+        with transaction.atomic():
+            written["products"] += _rebuild(
+                ProductDailySales, "product_id", "product_id", date
+            )
+            written["collections"] += _rebuild(
+                CollectionDailySales, "collection_id", "product__collection_id", date
+            )
+    return written
+
+
+def get_best_seller_windows():
+    return getattr(settings, "STORE_BEST_SELLER_WINDOWS", [7, 30])
+
+
+def _top(rows, size):
+    return sorted(rows, key=lambda row: (-row["units"], row["product_id"]))[:size]
+
+
+def refresh_best_sellers():
+    """Recomputes every ranking from the daily rollups; returns the row count."""
+    size = getattr(settings, "STORE_BEST_SELLERS_SIZE", 100)
+    today = timezone.localdate()
+    rankings = []
+    for window in get_best_seller_windows():
+        rows = list(
+            ProductDailySales.objects.filter(date__gt=today - timedelta(days=window))
+            .values("product_id", "product__collection_id")
+            .annotate(units=Sum("units"), revenue=Sum("revenue"))
+            .order_by()
+        )
+        by_collection = defaultdict(list)
+        for row in rows:
+            by_collection[row["product__collection_id"]].append(row)
+        scopes = [(None, rows)] + list(by_collection.items())
+        rankings += [
+            BestSeller(
+                window=window,
+                collection_id=collection_id,
+                product_id=row["product_id"],
+                units=row["units"],
+                revenue=row["revenue"],
+            )
+            for collection_id, scope_rows in scopes
+            for row in _top(scope_rows, size)
+        ]
+    with transaction.atomic():
+        BestSeller.objects.all().delete()
+        BestSeller.objects.bulk_create(rankings)
+    invalidate(BEST_SELLERS)
+    return len(rankings)
@@ -0,0 +1,226 @@
+import codecs
+import csv
+import json
+from collections import Counter
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+
+from store import cache, carts, search
+from store.models import Collection, Product
+from store.serializers import ProductImportSerializer
+
+"""
+Bulk product import/export for catalog syncs.
+
+Imports are read from the request stream one line at a time, validated and
+upserted by slug in chunks, each chunk in its own transaction. bulk_create
+and bulk_update skip model signals, so every chunk maintains the search
+index and Collection.products_count itself. The catalog cache and cart
+summaries are invalidated once at the end.
+"""
+
+CHUNK_SIZE = 1000
+EXPORT_FIELDS = [
+    "id",
+    "title",
+    "slug",
+    "description",
+    "unit_price",
+    "inventory",
+    "collection",
+]
+# validated data key -> bulk_update field name
+UPDATE_FIELDS = {
+    "title": "title",
+    "description": "description",
+    "unit_price": "unit_price",
+    "inventory": "inventory",
+    "collection_id": "collection",
+    "last_update": "last_update",
+}
+
+
+def read_ndjson(lines):
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, {"non_field_errors": ["Invalid JSON."]}
+            continue
+        if not isinstance(row, dict):
+            yield number, None, {"non_field_errors": ["Expected a JSON object."]}
+            continue
+        yield number, row, None
+
+
+def read_csv(lines):
+    # the header is line 1
+    for number, row in enumerate(csv.DictReader(lines), start=2):
+        yield number, row, None
+
+
+def read_rows(stream, content_type):
+    lines = codecs.iterdecode(stream, "utf-8")
+    if content_type.startswith("text/csv"):
+        return read_csv(lines)
+    return read_ndjson(lines)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def upsert_chunk(rows):
+    """Upserts validated (number, data) rows by slug; returns (created, updated)."""
+    by_slug = {data["slug"]: data for _, data in rows}
+    existing = {}
+    # descending id so the oldest product wins when a slug is duplicated
+    for product in Product.objects.filter(slug__in=by_slug).order_by("-id"):
+        existing[product.slug] = product
+
+    now = timezone.now()
+    deltas = Counter()
+    to_create, to_update = [], []
+    update_fields = {"last_update"}
+    for slug, data in by_slug.items():
+        product = existing.get(slug)
+        if product is None:
+            to_create.append(Product(**data))
+            deltas[data["collection_id"]] += 1
+            continue
+        changed = {
+            field: value
+            for field, value in data.items()
+            if getattr(product, field) != value
+        }
+        if not changed:
+            # ERP syncs resend mostly unchanged rows; skip them entirely
+            continue
+        if "collection_id" in changed:
+            deltas[product.collection_id] -= 1
+            deltas[data["collection_id"]] += 1
+        for field, value in changed.items():
+            setattr(product, field, value)
+        update_fields.update(changed)
+        product.last_update = now
+        to_update.append(product)
+
+    with transaction.atomic():
+        Product.objects.bulk_create(to_create, batch_size=CHUNK_SIZE)
+        if to_update:
+            # bulk_update builds a CASE per field and row: only send what changed
+            Product.objects.bulk_update(
+                to_update,
+                [UPDATE_FIELDS[field] for field in update_fields],
+                batch_size=CHUNK_SIZE,
+            )
+        for collection_id, delta in deltas.items():
+            if delta:
+                Collection.objects.filter(pk=collection_id).update(
+                    products_count=F("products_count") + delta
+                )
+        # re-read so created rows have ids on backends without RETURNING
+        search.index_products(
+            to_update
+            + list(
+                Product.objects.filter(
+                    slug__in=[product.slug for product in to_create]
+                ).only("id", "title", "description")
+            )
+        )
+    return len(to_create), len(to_update)
+
+
+def validate_row(serializer, row):
+    """Returns (data, errors) for one row, reusing the serializer's fields."""
+    try:
+        return serializer.run_validation(row), None
+    except ValidationError as exc:
+        return None, as_serializer_error(exc)
+
+
+def import_products(rows, chunk_size=CHUNK_SIZE):
+    collection_ids = set(Collection.objects.values_list("id", flat=True))
+    # one instance for the whole import: building serializer fields per row
+    # costs more than validating it
+    serializer = ProductImportSerializer(context={"collection_ids": collection_ids})
+    report = {"created": 0, "updated": 0, "unchanged": 0, "errors": []}
+    for chunk in chunked(rows, chunk_size):
+        valid = []
+        seen = set()
+        for number, row, errors in chunk:
+            if errors is None:
+                data, errors = validate_row(serializer, row)
+            if errors is None:
+                if data["slug"] not in seen:
+                    seen.add(data["slug"])
+                    valid.append((number, data))
+                    continue
+                errors = {"slug": ["Duplicate slug in the same chunk."]}
+            report["errors"].append({"row": number, "errors": errors})
+        if valid:
+            created, updated = upsert_chunk(valid)
+            report["created"] += created
+            report["updated"] += updated
+            report["unchanged"] += len(valid) - created - updated
+    cache.invalidate(cache.CATALOG)
+    cache.invalidate(carts.SUMMARIES)
+    return report
+
+
+class Echo:
+    """File-like object whose write() returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_products(batch_size=CHUNK_SIZE):
+    # keyset batches rather than iterator(): MySQL drivers buffer the whole
+    # result set client side, so iterator() alone does not bound memory there
+    last_id = 0
+    while True:
+        batch = list(
+            Product.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list(
+                "id",
+                "title",
+                "slug",
+                "description",
+                "unit_price",
+                "inventory",
+                "collection_id",
+            )[:batch_size]
+        )
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1][0]
+
+
+def export_csv():
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in iter_products():
+        yield writer.writerow(row)
+
+
+def export_ndjson():
+    for row in iter_products():
+        product = dict(zip(EXPORT_FIELDS, row))
+        product["unit_price"] = str(product["unit_price"])
+        yield json.dumps(product) + "\n"
@@ -0,0 +1,137 @@
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+"""
+Read-through response cache for the catalog endpoints.
+
+Cached responses are keyed by the absolute path and the sorted query
+parameters (filters, search, ordering, page) plus a namespace version.
+Invalidation never deletes keys: saving or deleting a catalog model bumps
+the version (see store.signals.handlers) so every older entry is orphaned
+and expires on its own.
+"""
+
+CATALOG = "catalog"
+
+
+def get_cache():
+    return caches[getattr(settings, "STORE_CACHE_ALIAS", "default")]
+
+
+def _version_key(namespace):
+    return f"store:{namespace}:version"
+
+
+def _stats_key(namespace, outcome):
+    return f"store:{namespace}:{outcome}"
+
+
+def get_version(namespace):
+    cache = get_cache()
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        version = uuid4().hex
+        # add() so concurrent first requests agree on a single version
+        cache.add(_version_key(namespace), version, timeout=None)
+        version = cache.get(_version_key(namespace), version)
+    return version
+
+
+def invalidate(namespace=CATALOG):
+    get_cache().set(_version_key(namespace), uuid4().hex, timeout=None)
+
+
+def _incr(key):
+    cache = get_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the key was evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def get_stats(namespace=CATALOG):
+    cache = get_cache()
+    hits = cache.get(_stats_key(namespace, "hits"), 0)
+    misses = cache.get(_stats_key(namespace, "misses"), 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / total if total else 0.0,
+    }
+
+
+def reset_stats(namespace=CATALOG):
+    get_cache().delete_many(
+        [_stats_key(namespace, "hits"), _stats_key(namespace, "misses")]
+    )
+
+
+def make_key(request, namespace=CATALOG):
+    params = sorted(
+        (key, value)
+        for key in request.query_params
+        for value in request.query_params.getlist(key)
+    )
+    query = "&".join(f"{key}={value}" for key, value in params)
+    url = request.build_absolute_uri(request.path)
+    digest = md5(f"{url}?{query}".encode()).hexdigest()
+    return f"store:{namespace}:{get_version(namespace)}:{digest}"
+
+
+def make_object_keys(request, ids, namespace=CATALOG):
+    """
+    Per-object keys for batched get_many/set_many lookups. They vary with
+    the host and the sparse fieldset, like the serialized data does.
+    """
+    variant = md5(
+        "|".join(
+            [
+                request.get_host(),
+                request.query_params.get("fields", ""),
+                request.query_params.get("expand", ""),
+            ]
+        ).encode()
+    ).hexdigest()
+    version = get_version(namespace)
+    return {id: f"store:{namespace}:{version}:{variant}:{id}" for id in ids}
+
+
+class CachedResponseMixin:
+    """
+    Serves list and retrieve from the store cache. Permission checks run
+    in initial() before the handler, so only authorised requests are
+    answered from the cache.
+    """
+
+    cache_namespace = CATALOG
+
+    def get_cache_timeout(self):
+        return getattr(settings, "STORE_RESPONSE_CACHE_TIMEOUT", 5 * 60)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        cache = get_cache()
+        key = make_key(request, self.cache_namespace)
+        data = cache.get(key)
+        if data is not None:
+            _incr(_stats_key(self.cache_namespace, "hits"))
+            return Response(data, headers={"X-Cache": "HIT"})
+
+        _incr(_stats_key(self.cache_namespace, "misses"))
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.get_cache_timeout())
+        response["X-Cache"] = "MISS"
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
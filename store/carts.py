@@ -0,0 +1,587 @@
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+from time import monotonic, perf_counter, sleep
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Prefetch, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from store.cache import get_cache, get_version
+from store.models import Cart, CartItem, Product
+
+"""
+Cart storage engines behind CartViewSet, CartItemViewSet and checkout.
+
+STORE_CART_STORAGE selects the engine:
+
+- DatabaseCartStorage keeps carts in the Cart/CartItem tables.
+- CacheCartStorage keeps each cart as one cache entry (a hash of
+  product_id -> [item_id, quantity]) with a sliding TTL, and only writes
+  Cart/CartItem rows when CreateOrderSerializer materializes the order.
+  Changes hold a per-cart lock taken with cache.add(), so concurrent
+  writers don't overwrite each other's entry. Use a Redis cache alias in
+  production; LocMem works in tests.
+
+Both engines return Cart and CartItem instances, so the serializers and
+the API shape are the same.
+
+get_cart_summary() serves the item count and total from a per-cart cache
+entry. Engines drop it after every change to the cart; its key also
+carries the SUMMARIES version, which product saves and imports bump, so a
+price change orphans every summary while checkouts and image or
+collection edits leave them alone. CartItem saves and deletes made
+elsewhere are covered by a signal.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class CartBusy(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The cart is being updated by another request, try again."
+    default_code = "cart_busy"
+
+
+def parse_cart_id(cart_id):
+    try:
+        return UUID(str(cart_id))
+    except ValueError:
+        return None
+
+
+ADD = "add"
+SET = "set"
+REMOVE = "remove"
+
+
+def apply_operations_to(quantities, operations):
+    """
+    Applies add/set/remove operations, in order, to a {product_id: quantity}
+    mapping and returns the resulting mapping.
+    """
+    quantities = dict(quantities)
+    for operation in operations:
+        product_id = operation["product_id"]
+        if operation["operation"] == REMOVE:
+            quantities.pop(product_id, None)
+        elif operation["operation"] == SET:
+            quantities[product_id] = operation["quantity"]
+        else:
+            quantities[product_id] = (
+                quantities.get(product_id, 0) + operation["quantity"]
+            )
+    return quantities
+
+
+def item_total_expression(prefix=""):
+    return ExpressionWrapper(
+        F(f"{prefix}quantity") * F(f"{prefix}product__unit_price"),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def with_totals(queryset):
+    """
+    Annotates total_price on the carts and on their prefetched items, so
+    the serializers don't compute them in Python.
+    """
+    items = CartItem.objects.select_related("product").annotate(
+        total_price=item_total_expression()
+    )
+    return queryset.annotate(
+        total_price=Coalesce(Sum(item_total_expression("items__")), Decimal(0))
+    ).prefetch_related(Prefetch("items", queryset=items))
+
+
+SUMMARIES = "cart-summaries"
+
+
+def summary_key(cart_id):
+    return f"store:cart:{cart_id}:summary:{get_version(SUMMARIES)}"
+
+
+def get_cart_summary(cart_id):
+    """Returns the cart's item count and total, or None if there is no cart."""
+    cart_id = parse_cart_id(cart_id)
+    if cart_id is None:
+        return None
+    cache = get_cache()
+    key = summary_key(cart_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = get_cart_storage().summarize(cart_id)
+        if summary is None:
+            return None
+        timeout = getattr(settings, "STORE_CART_SUMMARY_TIMEOUT", 5 * 60)
+        cache.set(key, summary, timeout)
+    return summary
+
+
+def invalidate_summary(cart_id):
+    # after commit, so a concurrent reader can't cache the old totals again
+    transaction.on_commit(lambda: get_cache().delete(summary_key(cart_id)))
+
+
+UPSERT_SQL = {
+    "mysql": (
+        "INSERT INTO {table} ({cart}, {product}, {quantity}) VALUES (%s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE {quantity} = {quantity} + VALUES({quantity})"
+    ),
+    "postgresql": (
+        "INSERT INTO {table} ({cart}, {product}, {quantity}) VALUES (%s, %s, %s) "
+        "ON CONFLICT ({cart}, {product}) "
+        "DO UPDATE SET {quantity} = {table}.{quantity} + EXCLUDED.{quantity}"
+    ),
+    "sqlite": (
+        "INSERT INTO {table} ({cart}, {product}, {quantity}) VALUES (%s, %s, %s) "
+        "ON CONFLICT ({cart}, {product}) "
+        "DO UPDATE SET {quantity} = {quantity} + excluded.{quantity}"
+    ),
+}
+
+
+def supports_upsert():
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 24, 0)
+    return connection.vendor in UPSERT_SQL
+
+
+class DatabaseCartStorage:
+    def create_cart(self):
+        return Cart.objects.create()
+
+    def get_cart(self, cart_id, queryset=None):
+        if parse_cart_id(cart_id) is None:
+            return None
+        queryset = queryset if queryset is not None else Cart.objects.all()
+        return queryset.filter(pk=cart_id).first()
+
+    def cart_exists(self, cart_id):
+        return Cart.objects.filter(pk=cart_id).exists()
+
+    def delete_cart(self, cart_id):
+        Cart.objects.filter(pk=cart_id).delete()
+        invalidate_summary(cart_id)
+
+    def get_items(self, cart_id):
+        return (
+            CartItem.objects.filter(cart_id=cart_id)
+            .select_related("product")
+            .annotate(total_price=item_total_expression())
+        )
+
+    def count_items(self, cart_id):
+        return CartItem.objects.filter(cart_id=cart_id).count()
+
+    def get_item(self, cart_id, item_id):
+        try:
+            return self.get_items(cart_id).filter(pk=item_id).first()
+        except ValueError:
+            return None
+
+    def add_item(self, cart_id, product_id, quantity):
+        """
+        Adds quantity to the cart line as one atomic INSERT ... ON CONFLICT /
+        ON DUPLICATE KEY statement, so concurrent adds neither lose
+        increments nor collide on unique_together(cart, product). Raises
+        Cart.DoesNotExist when the cart is missing.
+        """
+        if parse_cart_id(cart_id) is None:
+            raise Cart.DoesNotExist()
+        try:
+            if supports_upsert():
+                item = self.upsert_item(cart_id, product_id, quantity)
+            else:
+                item = self.update_or_insert_item(cart_id, product_id, quantity)
+        except IntegrityError:
+            # the cart foreign key failed, rather than checking before every add
+            if not self.cart_exists(cart_id):
+                raise Cart.DoesNotExist()
+            raise
+        invalidate_summary(cart_id)
+        return item
+
+    def upsert_item(self, cart_id, product_id, quantity):
+        opts = CartItem._meta
+        quote = connection.ops.quote_name
+        sql = UPSERT_SQL[connection.vendor].format(
+            table=quote(opts.db_table),
+            cart=quote(opts.get_field("cart").column),
+            product=quote(opts.get_field("product").column),
+            quantity=quote(opts.get_field("quantity").column),
+        )
+        params = [
+            opts.get_field("cart").get_db_prep_value(cart_id, connection),
+            product_id,
+            quantity,
+        ]
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+            # MySQL has no RETURNING: read the row back in the same transaction
+            return CartItem.objects.get(cart_id=cart_id, product_id=product_id)
+
+    def update_or_insert_item(self, cart_id, product_id, quantity):
+        """Portable fallback: F() increment, insert, retry on a lost race."""
+        items = CartItem.objects.filter(cart_id=cart_id, product_id=product_id)
+        with transaction.atomic():
+            if not items.update(quantity=F("quantity") + quantity):
+                try:
+                    with transaction.atomic():
+                        return CartItem.objects.create(
+                            cart_id=cart_id, product_id=product_id, quantity=quantity
+                        )
+                except IntegrityError:
+                    if not items.update(quantity=F("quantity") + quantity):
+                        raise
+            return items.get()
+
+    def set_quantity(self, item, quantity):
+        # update() rather than save(), which would re-insert a removed item;
+        # it sends no post_save, so the summary is invalidated here
+        if not CartItem.objects.filter(pk=item.pk).update(quantity=quantity):
+            raise CartItem.DoesNotExist()
+        invalidate_summary(item.cart_id)
+        item.quantity = quantity
+        return item
+
+    def remove_item(self, item):
+        item.delete()
+
+    def apply_operations(self, cart_id, operations):
+        if parse_cart_id(cart_id) is None:
+            raise Cart.DoesNotExist()
+        product_ids = {operation["product_id"] for operation in operations}
+        with transaction.atomic():
+            if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+                raise Cart.DoesNotExist()
+            items = {
+                item.product_id: item
+                for item in CartItem.objects.filter(
+                    cart_id=cart_id, product_id__in=product_ids
+                )
+            }
+            quantities = apply_operations_to(
+                {product_id: item.quantity for product_id, item in items.items()},
+                operations,
+            )
+            to_create, to_update = [], []
+            for product_id, quantity in quantities.items():
+                item = items.get(product_id)
+                if item is None:
+                    to_create.append(
+                        CartItem(
+                            cart_id=cart_id, product_id=product_id, quantity=quantity
+                        )
+                    )
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    to_update.append(item)
+            removed = [
+                item.id
+                for product_id, item in items.items()
+                if product_id not in quantities
+            ]
+            if removed:
+                CartItem.objects.filter(pk__in=removed).delete()
+            CartItem.objects.bulk_update(to_update, ["quantity"])
+            CartItem.objects.bulk_create(to_create)
+            invalidate_summary(cart_id)
+
+    def summarize(self, cart_id):
+        if parse_cart_id(cart_id) is None:
+            return None
+        return (
+            Cart.objects.filter(pk=cart_id)
+            .annotate(
+                items_count=Count("items"),
+                total_quantity=Coalesce(Sum("items__quantity"), 0),
+                total_price=Coalesce(Sum(item_total_expression("items__")), Decimal(0)),
+            )
+            .values("id", "items_count", "total_quantity", "total_price")
+            .first()
+        )
+
+    def materialize(self, cart_id):
+        """Makes sure Cart/CartItem rows exist for checkout."""
+
+
+class CacheCartStorage:
+    def __init__(self):
+        self.timeout = getattr(settings, "STORE_CART_TTL", 7 * 24 * 60 * 60)
+        self.lock_timeout = getattr(settings, "STORE_CART_LOCK_TIMEOUT", 10)
+        self.lock_wait = getattr(settings, "STORE_CART_LOCK_WAIT", 5)
+
+    def key(self, cart_id):
+        return f"store:cart:{cart_id}"
+
+    @contextmanager
+    def locked(self, cart_id):
+        """
+        Holds the cart's lock around a load() / store() pair. The lock
+        expires after lock_timeout seconds in case its holder dies; waiting
+        longer than lock_wait raises CartBusy.
+        """
+        cache = get_cache()
+        key = f"{self.key(parse_cart_id(cart_id))}:lock"
+        token = uuid4().hex
+        deadline = monotonic() + self.lock_wait
+        while not cache.add(key, token, self.lock_timeout):
+            if monotonic() >= deadline:
+                raise CartBusy()
+            sleep(0.005)
+        try:
+            yield
+        finally:
+            # don't release a lock that expired and was taken by someone else
+            if cache.get(key) == token:
+                cache.delete(key)
+
+    def load(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            return None, None
+        return cart_id, get_cache().get(self.key(cart_id))
+
+    def store(self, cart_id, data):
+        # every write slides the expiry, so only abandoned carts expire
+        get_cache().set(self.key(cart_id), data, self.timeout)
+        invalidate_summary(cart_id)
+
+    def build_items(self, cart_id, data):
+        products = Product.objects.only("id", "title", "unit_price").in_bulk(
+            [int(product_id) for product_id in data["items"]]
+        )
+        items = [
+            CartItem(
+                id=item_id,
+                cart_id=cart_id,
+                product=products[int(product_id)],
+                quantity=quantity,
+            )
+            for product_id, (item_id, quantity) in data["items"].items()
+            # deleted products drop out, as CASCADE would do in the database
+            if int(product_id) in products
+        ]
+        return sorted(items, key=lambda item: item.id)
+
+    def create_cart(self):
+        cart = Cart(id=uuid4(), created_at=timezone.now())
+        self.store(
+            cart.id,
+            {"created_at": cart.created_at, "next_id": 1, "items": {}},
+        )
+        cart._prefetched_objects_cache = {"items": []}
+        return cart
+
+    def get_cart(self, cart_id, queryset=None):
+        cart_id, data = self.load(cart_id)
+        if data is None:
+            return None
+        cart = Cart(id=cart_id, created_at=data["created_at"])
+        # serve cart.items.all() from the cache entry instead of the database
+        cart._prefetched_objects_cache = {"items": self.build_items(cart_id, data)}
+        return cart
+
+    def cart_exists(self, cart_id):
+        return self.load(cart_id)[1] is not None
+
+    def delete_cart(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is not None:
+            get_cache().delete(self.key(cart_id))
+            invalidate_summary(cart_id)
+
+    def get_items(self, cart_id):
+        cart_id, data = self.load(cart_id)
+        if data is None:
+            return []
+        return self.build_items(cart_id, data)
+
+    def count_items(self, cart_id):
+        data = self.load(cart_id)[1]
+        return len(data["items"]) if data is not None else 0
+
+    def get_item(self, cart_id, item_id):
+        return next(
+            (item for item in self.get_items(cart_id) if str(item.id) == str(item_id)),
+            None,
+        )
+
+    def add_item(self, cart_id, product_id, quantity):
+        with self.locked(cart_id):
+            cart_id, data = self.load(cart_id)
+            if data is None:
+                raise Cart.DoesNotExist()
+            item_id, current = data["items"].get(str(product_id), (data["next_id"], 0))
+            if not current:
+                data["next_id"] += 1
+            data["items"][str(product_id)] = [item_id, current + quantity]
+            self.store(cart_id, data)
+        return CartItem(
+            id=item_id,
+            cart_id=cart_id,
+            product_id=product_id,
+            quantity=current + quantity,
+        )
+
+    def set_quantity(self, item, quantity):
+        with self.locked(item.cart_id):
+            cart_id, data = self.load(item.cart_id)
+            # the item may have been removed since it was read
+            entry = data["items"].get(str(item.product_id)) if data else None
+            if entry is None or entry[0] != item.id:
+                raise CartItem.DoesNotExist()
+            data["items"][str(item.product_id)] = [item.id, quantity]
+            self.store(cart_id, data)
+        item.quantity = quantity
+        return item
+
+    def remove_item(self, item):
+        with self.locked(item.cart_id):
+            cart_id, data = self.load(item.cart_id)
+            if data is not None:
+                data["items"].pop(str(item.product_id), None)
+                self.store(cart_id, data)
+
+    def apply_operations(self, cart_id, operations):
+        with self.locked(cart_id):
+            cart_id, data = self.load(cart_id)
+            if data is None:
+                raise Cart.DoesNotExist()
+            items = {
+                int(product_id): item for product_id, item in data["items"].items()
+            }
+            quantities = apply_operations_to(
+                {product_id: quantity for product_id, (_, quantity) in items.items()},
+                operations,
+            )
+            for product_id, quantity in quantities.items():
+                if product_id not in items:
+                    items[product_id] = [data["next_id"], 0]
+                    data["next_id"] += 1
+                items[product_id][1] = quantity
+            data["items"] = {
+                str(product_id): item
+                for product_id, item in items.items()
+                if product_id in quantities
+            }
+            self.store(cart_id, data)
+
+    def summarize(self, cart_id):
+        cart_id, data = self.load(cart_id)
+        if data is None:
+            return None
+        prices = dict(
+            Product.objects.filter(
+                pk__in=[int(product_id) for product_id in data["items"]]
+            ).values_list("id", "unit_price")
+        )
+        quantities = {
+            int(product_id): quantity
+            for product_id, (_, quantity) in data["items"].items()
+            if int(product_id) in prices
+        }
+        return {
+            "id": cart_id,
+            "items_count": len(quantities),
+            "total_quantity": sum(quantities.values()),
+            "total_price": sum(
+                (
+                    prices[product_id] * quantity
+                    for product_id, quantity in quantities.items()
+                ),
+                Decimal(0),
+            ),
+        }
+
+    def materialize(self, cart_id):
+        """
+        Writes the cart to Cart/CartItem so checkout can run against the
+        database. The cache entry is removed by delete_cart() once the order
+        is committed.
+        """
+        cart_id, data = self.load(cart_id)
+        if data is None:
+            return
+        with transaction.atomic():
+            Cart.objects.filter(pk=cart_id).delete()
+            Cart.objects.create(id=cart_id)
+            CartItem.objects.bulk_create(
+                CartItem(
+                    cart_id=cart_id, product_id=item.product_id, quantity=item.quantity
+                )
+                for item in self.build_items(cart_id, data)
+            )
+
+
+def delete_abandoned_carts(max_age=None, batch_size=None):
+    """
+    Deletes Cart rows (and their items) created more than max_age seconds
+    ago, batch_size carts per transaction in primary key order, so locks
+    stay short. Carts locked by a checkout in progress are skipped; checkout
+    deletes them itself. Returns the totals.
+    """
+    if max_age is None:
+        max_age = getattr(settings, "STORE_ABANDONED_CART_AGE", 14 * 24 * 60 * 60)
+    if batch_size is None:
+        batch_size = getattr(settings, "STORE_CART_SWEEP_BATCH_SIZE", 500)
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    stats = {"batches": 0, "carts": 0, "items": 0, "seconds": 0.0}
+    candidates = Cart.objects.filter(created_at__lt=cutoff).order_by("pk")
+    last_id = None
+    while True:
+        batch = candidates if last_id is None else candidates.filter(pk__gt=last_id)
+        ids = list(batch.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        start = perf_counter()
+        with transaction.atomic():
+            locked = list(
+                Cart.objects.select_for_update(skip_locked=True)
+                .filter(pk__in=ids, created_at__lt=cutoff)
+                .values_list("pk", flat=True)
+            )
+            # _raw_delete(): the CartItem post_delete signal would make
+            # delete() load every item and drop its summary one at a time
+            items = CartItem.objects.filter(cart_id__in=locked)._raw_delete(
+                CartItem.objects.db
+            )
+            Cart.objects.filter(pk__in=locked)._raw_delete(Cart.objects.db)
+            keys = [summary_key(cart_id) for cart_id in locked]
+            transaction.on_commit(lambda: get_cache().delete_many(keys))
+        seconds = perf_counter() - start
+
+        stats["batches"] += 1
+        stats["carts"] += len(locked)
+        stats["items"] += items
+        stats["seconds"] += seconds
+        logger.info(
+            "Deleted %d abandoned carts and %d items in %.3fs",
+            len(locked),
+            items,
+            seconds,
+        )
+    logger.info(
+        "Abandoned cart sweep: %(carts)d carts and %(items)d items "
+        "in %(batches)d batches, %(seconds).3fs",
+        stats,
+    )
+    return stats
+
+
+@lru_cache(maxsize=None)
+def get_cart_storage():
+    path = getattr(settings, "STORE_CART_STORAGE", "store.carts.DatabaseCartStorage")
+    return import_string(path)()
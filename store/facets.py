@@ -0,0 +1,106 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from store import cache
+
+"""
+Facet counts for the product list (?facets=collection,price).
+
+All requested facets are computed from the filtered queryset in a single
+GROUP BY collection_id query with one conditional COUNT per price bucket,
+and cached per normalized filter set so paging through results reuses
+them.
+"""
+
+FACETS = ["collection", "price"]
+DEFAULT_PRICE_EDGES = [10, 25, 50, 100]
+# parameters that do not change which products match
+IGNORED_PARAMS = {
+    "page",
+    "page_size",
+    "cursor",
+    "ordering",
+    "fields",
+    "expand",
+    "total",
+    "facets",
+}
+
+
+def get_price_buckets():
+    edges = getattr(settings, "STORE_PRICE_FACET_EDGES", DEFAULT_PRICE_EDGES)
+    bounds = [None, *edges, None]
+    return list(zip(bounds, bounds[1:]))
+
+
+def bucket_filter(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(unit_price__gte=low)
+    if high is not None:
+        condition &= Q(unit_price__lt=high)
+    return condition
+
+
+def compute_facets(queryset, requested):
+    buckets = get_price_buckets()
+    rows = (
+        queryset.order_by()
+        .values("collection_id")
+        .annotate(
+            count=Count("id"),
+            **{
+                f"price_{index}": Count("id", filter=bucket_filter(low, high))
+                for index, (low, high) in enumerate(buckets)
+            },
+        )
+    )
+
+    facets = {}
+    rows = list(rows)
+    if "collection" in requested:
+        facets["collection"] = [
+            {"id": row["collection_id"], "count": row["count"]}
+            for row in sorted(rows, key=lambda row: row["collection_id"])
+        ]
+    if "price" in requested:
+        facets["price"] = [
+            {
+                "min": low,
+                "max": high,
+                "count": sum(row[f"price_{index}"] for row in rows),
+            }
+            for index, (low, high) in enumerate(buckets)
+        ]
+    return facets
+
+
+def make_key(request, requested):
+    params = sorted(
+        (key, value)
+        for key in request.query_params
+        if key not in IGNORED_PARAMS
+        for value in request.query_params.getlist(key)
+    )
+    digest = md5(repr((params, requested)).encode()).hexdigest()
+    return f"store:{cache.CATALOG}:{cache.get_version(cache.CATALOG)}:facets:{digest}"
+
+
+def get_facets(request, queryset):
+    requested = [
+        name
+        for name in request.query_params.get("facets", "").split(",")
+        if name in FACETS
+    ]
+    if not requested:
+        return None
+    key = make_key(request, requested)
+    facets = cache.get_cache().get(key)
+    if facets is None:
+        facets = compute_facets(queryset, requested)
+        cache.get_cache().set(
+            key, facets, getattr(settings, "STORE_RESPONSE_CACHE_TIMEOUT", 5 * 60)
+        )
+    return facets
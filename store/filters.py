@@ -1,10 +1,73 @@
 from django_filters import filterset
-from django_filters.rest_framework import FilterSet
+from django_filters.rest_framework import DateFilter, FilterSet, NumberFilter
+from rest_framework.filters import SearchFilter
 
-from .models import Product
+from . import search
+from .models import (
+    CollectionDailySales,
+    Customer,
+    Order,
+    Product,
+    ProductDailySales,
+)
 
 
 class ProductFilter(FilterSet):
+    # price_with_tax is annotated by pricing.annotate_price_with_tax
+    price_with_tax__gt = NumberFilter(field_name="price_with_tax", lookup_expr="gt")
+    price_with_tax__lt = NumberFilter(field_name="price_with_tax", lookup_expr="lt")
+
     class Meta:
         model = Product
         fields = {"collection_id": ["exact"], "unit_price": ["gt", "lt"]}
+
+
+class CustomerFilter(FilterSet):
+    class Meta:
+        model = Customer
+        fields = {
+            "membership": ["exact"],
+            "order_count": ["gt", "lt"],
+            "lifetime_spend": ["gt", "lt"],
+            "last_order_at": ["gt", "lt"],
+        }
+
+
+class OrderFilter(FilterSet):
+    class Meta:
+        model = Order
+        fields = {
+            "payment_status": ["exact"],
+            "total_price": ["gt", "lt"],
+            "item_count": ["gt", "lt"],
+        }
+
+
+class DailySalesFilter(FilterSet):
+    since = DateFilter(field_name="date", lookup_expr="gte")
+    until = DateFilter(field_name="date", lookup_expr="lte")
+
+
+class ProductSalesFilter(DailySalesFilter):
+    class Meta:
+        model = ProductDailySales
+        fields = ["product", "product__collection"]
+
+
+class CollectionSalesFilter(DailySalesFilter):
+    class Meta:
+        model = CollectionDailySales
+        fields = ["collection"]
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on products, answered from the
+    inverted index in store.search instead of LIKE '%term%' scans.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return search.search(queryset, " ".join(terms))
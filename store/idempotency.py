@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+
+from store.cache import get_cache
+
+"""
+Idempotency-Key support for POST handlers that clients retry on timeout.
+
+The first request with a key claims it with cache.add() and runs; a 2xx
+response is stored for STORE_IDEMPOTENCY_TTL seconds and replayed,
+without running the handler, to later requests with the same key from
+the same user on the same path. A duplicate that arrives while the first
+is still running waits up to STORE_IDEMPOTENCY_WAIT seconds for its
+result, then gets 409. Reusing a key with a different body is a 422.
+Keys are released when the handler raises or answers 4xx/5xx, so the
+client can retry once it has fixed its input or the stock is back.
+
+A claim expires after STORE_IDEMPOTENCY_CLAIM_TIMEOUT seconds, so a key
+held by a worker that died is freed. While the handler runs (a checkout
+retrying deadlocks can take a while) a background thread refreshes the
+claim every third of that timeout, so a slow first request is never run
+a second time by a duplicate.
+
+The claim relies on an atomic add(), so use a shared cache such as Redis
+in production.
+"""
+
+HEADER = "Idempotency-Key"
+PENDING = "pending"
+DONE = "done"
+# headers worth replaying with a stored response
+REPLAYED_HEADERS = ["Location"]
+
+
+def _cache_key(request, key):
+    scope = f"{request.user.id or 'anonymous'}:{request.path}:{key}"
+    return f"store:idempotency:{md5(scope.encode()).hexdigest()}"
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return md5(body.encode()).hexdigest()
+
+
+def _replay(entry, fingerprint):
+    if entry["fingerprint"] != fingerprint:
+        return Response(
+            {"error": f"The {HEADER} was already used with a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(
+        entry["data"],
+        status=entry["status"],
+        headers={**entry["headers"], "Idempotent-Replayed": "true"},
+    )
+
+
+@contextmanager
+def _holding(cache_key, timeout):
+    """Keeps a pending claim from expiring until the block exits."""
+    stop = threading.Event()
+
+    def refresh():
+        cache = get_cache()
+        while not stop.wait(timeout / 3):
+            cache.touch(cache_key, timeout)
+
+    thread = threading.Thread(target=refresh, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        # stopped before the claim is replaced or released, so a late
+        # touch() never shortens the stored response's TTL
+        stop.set()
+        thread.join()
+
+
+def idempotent(handler):
+    """Honours the Idempotency-Key header on a viewset handler."""
+
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {"error": f"The {HEADER} must be at most 255 characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        cache = get_cache()
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        # refreshed while the handler runs, and expires if its worker dies
+        claim_timeout = getattr(settings, "STORE_IDEMPOTENCY_CLAIM_TIMEOUT", 60)
+        deadline = time.monotonic() + getattr(settings, "STORE_IDEMPOTENCY_WAIT", 10)
+        pending = {"state": PENDING, "fingerprint": fingerprint}
+        while not cache.add(cache_key, pending, claim_timeout):
+            entry = cache.get(cache_key)
+            # None: released by a failed first request; try to claim it again
+            if entry is not None and (
+                entry["state"] == DONE or entry["fingerprint"] != fingerprint
+            ):
+                return _replay(entry, fingerprint)
+            if time.monotonic() >= deadline:
+                return Response(
+                    {"error": f"A request with this {HEADER} is still in progress."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            time.sleep(0.1)
+
+        try:
+            with _holding(cache_key, claim_timeout):
+                response = handler(self, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if not status.is_success(response.status_code):
+            cache.delete(cache_key)
+            return response
+        cache.set(
+            cache_key,
+            {
+                "state": DONE,
+                "fingerprint": fingerprint,
+                "status": response.status_code,
+                "data": response.data,
+                "headers": {
+                    name: response[name]
+                    for name in REPLAYED_HEADERS
+                    if response.has_header(name)
+                },
+            },
+            getattr(settings, "STORE_IDEMPOTENCY_TTL", 24 * 60 * 60),
+        )
+        return response
+
+    return wrapper
@@ -0,0 +1,85 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from store.models import ProductImage
+
+"""
+Resized variants of product images.
+
+Every variant in STORE_IMAGE_VARIANTS is rendered in every format in
+STORE_IMAGE_FORMATS and saved to the image's storage next to the original,
+under a variants/ directory.
+"""
+
+DEFAULT_VARIANTS = {
+    "thumbnail": (150, 150),
+    "card": (400, 400),
+    "full": (1200, 1200),
+}
+DEFAULT_FORMATS = ["WEBP", "JPEG"]
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+
+
+def get_storage():
+    return ProductImage._meta.get_field("image").storage
+
+
+def render(original: Image.Image, size, image_format):
+    image = original.copy()
+    image.thumbnail(size)
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    output = BytesIO()
+    image.save(output, image_format, quality=85)
+    return output.getvalue()
+
+
+def render_variants(name):
+    """
+    Renders and stores all variants of the stored image name, returning
+    {variant: {format: storage name}}.
+    """
+    storage = get_storage()
+    variants = getattr(settings, "STORE_IMAGE_VARIANTS", DEFAULT_VARIANTS)
+    formats = getattr(settings, "STORE_IMAGE_FORMATS", DEFAULT_FORMATS)
+
+    directory, filename = os.path.split(name)
+    # keep the original extension so x.jpg and x.png get distinct variants
+    stem = filename.replace(".", "_")
+    with storage.open(name) as file:
+        original = Image.open(file)
+        original.load()
+
+    stored = {}
+    for variant, size in variants.items():
+        stored[variant] = {}
+        for image_format in formats:
+            extension = EXTENSIONS[image_format]
+            target = os.path.join(
+                directory, "variants", f"{stem}_{variant}.{extension}"
+            )
+            if storage.exists(target):
+                storage.delete(target)
+            stored[variant][extension] = storage.save(
+                target, ContentFile(render(original, size, image_format))
+            )
+    return stored
+
+
+def variant_urls(variants, request=None):
+    storage = get_storage()
+    return {
+        variant: {
+            extension: (
+                request.build_absolute_uri(storage.url(name))
+                if request is not None
+                else storage.url(name)
+            )
+            for extension, name in files.items()
+        }
+        for variant, files in variants.items()
+    }
@@ -0,0 +1,115 @@
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from store.models import Product
+
+"""
+Stock reservation for checkout.
+
+reserve() locks every product in the order with SELECT ... FOR UPDATE in
+ascending id order, so two checkouts sharing products always lock them in
+the same order and can't deadlock on each other, checks availability and
+decrements all of them with one conditional UPDATE. That skips the
+signals that invalidate the catalog cache, on purpose: bumping the one
+catalog version on every checkout would orphan every cached catalog
+response at any real order rate. Cached inventory counts can lag by up to
+STORE_RESPONSE_CACHE_TIMEOUT; the check here, not the cached count, is
+what prevents overselling.
+
+Deadlocks can still happen against other writers (admin edits, bulk
+imports); retry_on_deadlock() reruns the whole checkout transaction with
+exponential backoff and jitter.
+"""
+
+# MySQL: 1213 deadlock, 1205 lock wait timeout. PostgreSQL: SQLSTATE 40P01
+# deadlock_detected, 40001 serialization_failure.
+MYSQL_RETRY_CODES = {1205, 1213}
+POSTGRESQL_RETRY_CODES = {"40P01", "40001"}
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        # {product_id: units available}
+        self.shortages = shortages
+        super().__init__(f"Insufficient stock for products {sorted(shortages)}")
+
+    @property
+    def messages(self):
+        return [
+            f"Only {available} left of product {product_id}."
+            for product_id, available in self.shortages.items()
+        ]
+
+
+def reserve(quantities):
+    """
+    Takes {product_id: quantity} out of Product.inventory. Must run inside
+    the checkout transaction; raises InsufficientStock without changing
+    anything when a product can't cover its quantity.
+    """
+    if not quantities:
+        return
+    product_ids = sorted(quantities)
+    available = dict(
+        Product.objects.select_for_update()
+        .filter(pk__in=product_ids)
+        .order_by("pk")
+        .values_list("pk", "inventory")
+    )
+    shortages = {
+        product_id: available.get(product_id, 0)
+        for product_id in product_ids
+        if available.get(product_id, 0) < quantities[product_id]
+    }
+    if shortages:
+        raise InsufficientStock(shortages)
+
+    requested = Case(
+        *[
+            When(pk=product_id, then=Value(quantities[product_id]))
+            for product_id in product_ids
+        ],
+        output_field=IntegerField(),
+    )
+    updated = Product.objects.filter(
+        pk__in=product_ids, inventory__gte=requested
+    ).update(inventory=F("inventory") - requested)
+    if updated != len(product_ids):
+        # unreachable while the rows are locked, but never oversell
+        raise InsufficientStock(
+            {product_id: available[product_id] for product_id in product_ids}
+        )
+
+
+def is_retryable(error):
+    cause = error.__cause__
+    if connection.vendor == "mysql":
+        return bool(getattr(cause, "args", None)) and cause.args[0] in MYSQL_RETRY_CODES
+    if connection.vendor == "postgresql":
+        return getattr(cause, "pgcode", None) in POSTGRESQL_RETRY_CODES
+    return False
+
+
+def retry_on_deadlock(func, *args, **kwargs):
+    """
+    Calls func, which opens its own transaction, again after a deadlock.
+    Inside an outer transaction a retry would reuse an aborted transaction,
+    so there the error is raised as is.
+    """
+    attempts = getattr(settings, "STORE_CHECKOUT_RETRIES", 3)
+    backoff = getattr(settings, "STORE_CHECKOUT_RETRY_BACKOFF", 0.05)
+    for attempt in range(attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as error:
+            if (
+                attempt == attempts
+                or connection.in_atomic_block
+                or not is_retryable(error)
+            ):
+                raise
+            time.sleep(backoff * 2**attempt * (1 + random.random()))
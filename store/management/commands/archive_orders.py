@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from store.orders import archive_orders
+
+
+class Command(BaseCommand):
+    help = "Moves completed orders older than --days to the archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, help="Defaults to STORE_ORDER_ARCHIVE_AGE"
+        )
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        stats = archive_orders(options["days"], options["batch_size"])
+        self.stdout.write(
+            "Archived {orders} orders and {items} items in {batches} batches "
+            "({seconds:.2f}s).".format(**stats)
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from store.models import Order
+from store.orders import refresh_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the stored total_price and item_count of every order, "
+        "in primary key batches so each update stays short"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        repaired = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Order.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            repaired += refresh_totals(Order.objects.filter(pk__in=ids))
+        self.stdout.write(f"Repaired {repaired} orders.")
@@ -0,0 +1,63 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from store.carts import CacheCartStorage, DatabaseCartStorage
+from store.models import Collection, Product
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures cart operations per second for each cart storage engine. "
+        "Fixtures are created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--carts", type=int, default=200)
+        parser.add_argument("--items", type=int, default=5)
+
+    def exercise(self, storage, products, carts):
+        """Create, add, re-add, update, read and delete: 4 ops + 2 per item."""
+        operations = 0
+        for _ in range(carts):
+            cart = storage.create_cart()
+            for product in products:
+                storage.add_item(cart.id, product.id, 1)
+                storage.add_item(cart.id, product.id, 1)
+                operations += 2
+            item = storage.get_items(cart.id)[0]
+            storage.set_quantity(item, 5)
+            storage.get_cart(cart.id)
+            storage.delete_cart(cart.id)
+            operations += 4
+        return operations
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                collection = Collection.objects.create(title="benchmark")
+                products = [
+                    Product.objects.create(
+                        title=f"Product {i}",
+                        slug=f"product-{i}",
+                        unit_price=10,
+                        inventory=100,
+                        collection=collection,
+                    )
+                    for i in range(options["items"])
+                ]
+                for storage in [DatabaseCartStorage(), CacheCartStorage()]:
+                    start = perf_counter()
+                    operations = self.exercise(storage, products, options["carts"])
+                    seconds = perf_counter() - start
+                    self.stdout.write(
+                        f"{storage.__class__.__name__:22} "
+                        f"{operations / seconds:10.0f} ops/s"
+                    )
+                raise Rollback()
+        except Rollback:
+            pass
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from core.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from rest_framework.exceptions import ValidationError
+from store.carts import DatabaseCartStorage
+from store.models import Collection, Order, OrderItem, Product
+from store.serializers import CreateOrderSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent checkouts that all buy a hot product with limited "
+        "stock, reports orders per second and fails on oversell. Creates and "
+        "deletes its own data; run it against MySQL or PostgreSQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--checkouts", type=int, default=50, help="Per thread")
+        parser.add_argument("--stock", type=int, default=500)
+        parser.add_argument(
+            "--products",
+            type=int,
+            default=5,
+            help="Products per cart, the hot product plus plentiful ones",
+        )
+
+    def handle(self, *args, **options):
+        storage = DatabaseCartStorage()
+        collection = Collection.objects.create(title="benchmark")
+        hot = Product.objects.create(
+            title="hot",
+            slug="hot",
+            unit_price=10,
+            inventory=options["stock"],
+            collection=collection,
+        )
+        others = [
+            Product.objects.create(
+                title=f"Product {i}",
+                slug=f"product-{i}",
+                unit_price=10,
+                inventory=10**9,
+                collection=collection,
+            )
+            for i in range(options["products"] - 1)
+        ]
+        users = [
+            User.objects.create(username=f"checkout-{i}", email=f"checkout-{i}@local")
+            for i in range(options["threads"])
+        ]
+
+        def worker(user):
+            outcomes = {"placed": 0, "out_of_stock": 0}
+            try:
+                for _ in range(options["checkouts"]):
+                    cart = storage.create_cart()
+                    # add in reverse id order; reserve() must still lock in order
+                    for product in reversed([hot] + others):
+                        storage.add_item(cart.id, product.id, 1)
+                    serializer = CreateOrderSerializer(
+                        data={"cart_id": cart.id}, context={"user_id": user.id}
+                    )
+                    serializer.is_valid(raise_exception=True)
+                    try:
+                        serializer.save()
+                        outcomes["placed"] += 1
+                    except ValidationError:
+                        storage.delete_cart(cart.id)
+                        outcomes["out_of_stock"] += 1
+            finally:
+                connection.close()
+            return outcomes
+
+        orders = Order.objects.filter(customer__user__in=users)
+        try:
+            start = perf_counter()
+            with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+                results = list(executor.map(worker, users))
+            seconds = perf_counter() - start
+
+            placed = sum(result["placed"] for result in results)
+            out_of_stock = sum(result["out_of_stock"] for result in results)
+            hot.refresh_from_db()
+            sold = (
+                OrderItem.objects.filter(product=hot).aggregate(sold=Sum("quantity"))[
+                    "sold"
+                ]
+                or 0
+            )
+            self.stdout.write(
+                f"{placed} orders in {seconds:.2f}s ({placed / seconds:.0f} orders/s), "
+                f"{out_of_stock} rejected as out of stock"
+            )
+            self.stdout.write(
+                f"hot product: stock {options['stock']}, sold {sold}, "
+                f"left {hot.inventory}"
+            )
+            if hot.inventory < 0 or sold + hot.inventory != options["stock"]:
+                raise CommandError("Inventory does not add up: oversold.")
+        finally:
+            OrderItem.objects.filter(order__in=orders).delete()
+            orders.delete()
+            for user in users:
+                user.delete()
+            Product.objects.filter(collection=collection).delete()
+            collection.delete()
@@ -0,0 +1,106 @@
+from random import Random
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from store import cache, search
+from store.filters import ProductSearchFilter
+from store.models import Collection, Product
+from store.views import ProductViewSet
+
+SYLLABLES = "ba ca da fe go hi ka lo ma ne or pa qu ri sa te un ve wo zy".split()
+VOCABULARY_SIZE = 5000
+SEED_COLLECTION = "Search benchmark"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the inverted index search backend with DRF's SearchFilter "
+        "on the current catalog. --seed N first adds N generated products "
+        "(indexed, and kept), e.g. --seed 1000000 for the 1M product comparison"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("terms", nargs="*")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--page-size", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def make_vocabulary(self, rng):
+        words = set()
+        while len(words) < VOCABULARY_SIZE:
+            words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+        return sorted(words)
+
+    def seed(self, count, batch_size):
+        """
+        Adds count products whose words follow a Zipf distribution, like
+        real catalog text, in batches that each commit with their search
+        terms. The generator is seeded, so runs are reproducible.
+        """
+        rng = Random(0)
+        words = self.make_vocabulary(rng)
+        weights = [1 / rank for rank in range(1, len(words) + 1)]
+        collection, _ = Collection.objects.get_or_create(title=SEED_COLLECTION)
+        start = Product.objects.filter(collection=collection).count()
+        start_time = perf_counter()
+        for offset in range(0, count, batch_size):
+            products = [
+                Product(
+                    title=" ".join(rng.choices(words, weights, k=4)).capitalize(),
+                    slug=f"search-benchmark-{start + offset + i}",
+                    description=" ".join(rng.choices(words, weights, k=30)),
+                    unit_price=rng.randint(100, 99999) / 100,
+                    inventory=100,
+                    collection=collection,
+                )
+                for i in range(min(batch_size, count - offset))
+            ]
+            # bulk_create skips the signals that count and index products
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+                Collection.objects.filter(pk=collection.pk).update(
+                    products_count=F("products_count") + len(products)
+                )
+                # re-read so created rows have ids on backends without RETURNING
+                search.index_products(
+                    Product.objects.filter(
+                        slug__in=[product.slug for product in products]
+                    ).only("id", "title", "description")
+                )
+            self.stdout.write(
+                f"Seeded {offset + len(products)}/{count} products "
+                f"in {perf_counter() - start_time:.2f}s."
+            )
+        cache.invalidate(cache.CATALOG)
+
+    def time_backend(self, backend, term, repeat, page_size):
+        request = Request(APIRequestFactory().get("/", {"search": term}))
+        view = ProductViewSet()
+        timings = []
+        for _ in range(repeat):
+            start = perf_counter()
+            queryset = backend.filter_queryset(request, Product.objects.all(), view)
+            list(queryset[:page_size])
+            timings.append(perf_counter() - start)
+        return median(timings)
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            self.seed(options["seed"], options["batch_size"])
+        self.stdout.write(f"{Product.objects.count()} products")
+        for term in options["terms"]:
+            for name, backend in [
+                ("SearchFilter", SearchFilter()),
+                ("ProductSearchFilter", ProductSearchFilter()),
+            ]:
+                seconds = self.time_backend(
+                    backend, term, options["repeat"], options["page_size"]
+                )
+                self.stdout.write(f"{term!r:20} {name:20} {seconds * 1000:8.2f} ms")
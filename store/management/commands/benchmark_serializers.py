@@ -0,0 +1,147 @@
+from statistics import median
+from time import perf_counter
+
+from core.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from store import cache
+from store.models import (
+    Cart,
+    CartItem,
+    Collection,
+    Customer,
+    Order,
+    OrderItem,
+    Product,
+    ProductImage,
+)
+from store.serializers import (
+    CartSerializer,
+    OrderSerializer,
+    ProductRowSerializer,
+    ProductSerializer,
+)
+from store.views import ProductViewSet
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Times product, cart and order serialization at several row counts, "
+        "and the product list endpoint with STORE_FAST_LIST off and on. "
+        "Fixtures are created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def measure(self, label, rows, build):
+        timings = []
+        for _ in range(self.repeat):
+            start = perf_counter()
+            build()
+            timings.append(perf_counter() - start)
+        self.stdout.write(f"{label:34} {rows:6} rows {median(timings) * 1000:10.2f} ms")
+
+    def create_fixtures(self, size):
+        collection = Collection.objects.create(title="benchmark")
+        Product.objects.bulk_create(
+            Product(
+                title=f"Product {i}",
+                slug=f"product-{i}",
+                description="benchmark product",
+                unit_price=10 + i % 90,
+                inventory=100,
+                collection=collection,
+            )
+            for i in range(size)
+        )
+        # re-read: bulk_create returns no primary keys on MySQL
+        products = list(Product.objects.filter(collection=collection))
+        ProductImage.objects.bulk_create(
+            ProductImage(product=product, image="store/images/dog.jpg")
+            for product in products
+        )
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=1) for product in products
+        )
+        user = User.objects.create(username="benchmark", email="benchmark@local")
+        customer = Customer.objects.get(user=user)
+        Order.objects.bulk_create(Order(customer=customer) for _ in range(size))
+        orders = list(Order.objects.filter(customer=customer))
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=2, unit_price=10)
+            for order, product in zip(orders, products)
+        )
+        return collection, cart, customer
+
+    def list_products(self, collection, fast):
+        # the response cache is bypassed so every call reaches the serializer
+        cache.invalidate()
+        request = APIRequestFactory().get(
+            "/store/products/",
+            {"collection_id": collection.id, "cursor": "", "page_size": 100},
+        )
+        force_authenticate(request, self.user)
+        with override_settings(ALLOWED_HOSTS=["testserver"], STORE_FAST_LIST=fast):
+            response = ProductViewSet.as_view({"get": "list"})(request)
+            response.render()
+        return response
+
+    def run(self, size):
+        collection, cart, customer = self.create_fixtures(size)
+        products = Product.objects.filter(collection=collection)
+
+        self.measure(
+            "ProductSerializer",
+            size,
+            lambda: ProductSerializer(
+                products.prefetch_related("images"), many=True
+            ).data,
+        )
+        self.measure(
+            "ProductRowSerializer",
+            size,
+            lambda: ProductRowSerializer(products.values(), many=True).data,
+        )
+        for fast in [False, True]:
+            self.measure(
+                f"GET /store/products/ fast={fast}",
+                min(size, 100),
+                lambda: self.list_products(collection, fast),
+            )
+        self.measure(
+            "CartSerializer",
+            size,
+            lambda: CartSerializer(
+                Cart.objects.prefetch_related("items__product").get(pk=cart.pk)
+            ).data,
+        )
+        self.measure(
+            "OrderSerializer",
+            size,
+            lambda: OrderSerializer(
+                Order.objects.filter(customer=customer)
+                .select_related("customer__user")
+                .prefetch_related("items__product"),
+                many=True,
+            ).data,
+        )
+
+    def handle(self, *args, **options):
+        self.repeat = options["repeat"]
+        self.user = User(username="benchmark-admin", is_staff=True, is_superuser=True)
+        for size in options["sizes"]:
+            try:
+                with transaction.atomic():
+                    self.run(size)
+                    raise Rollback()
+            except Rollback:
+                pass
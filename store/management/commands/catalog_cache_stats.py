@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from store import cache
+
+
+class Command(BaseCommand):
+    help = "Reports hit/miss ratios of the catalog response cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Reset the counters after reporting"
+        )
+
+    def handle(self, *args, **options):
+        stats = cache.get_stats(cache.CATALOG)
+        self.stdout.write(
+            f"hits: {stats['hits']}  misses: {stats['misses']}  "
+            f"hit ratio: {stats['hit_ratio']:.2%}"
+        )
+        if options["reset"]:
+            cache.reset_stats(cache.CATALOG)
+            self.stdout.write("Counters reset.")
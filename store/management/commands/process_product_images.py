@@ -0,0 +1,47 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from store import cache, images
+from store.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Generates resized variants for existing product images in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Regenerate variants for images that already have them",
+        )
+
+    def handle(self, *args, **options):
+        queryset = ProductImage.objects.exclude(image="")
+        if not options["all"]:
+            queryset = queryset.filter(variants={})
+        pending = list(queryset.values_list("id", "image"))
+        self.stdout.write(f"Processing {len(pending)} images...")
+
+        # forked workers must not share the parent's database connections
+        connections.close_all()
+        processed = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = {
+                executor.submit(images.render_variants, name): image_id
+                for image_id, name in pending
+            }
+            for future in as_completed(futures):
+                image_id = futures[future]
+                try:
+                    variants = future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"Image {image_id} failed: {exc}")
+                    continue
+                ProductImage.objects.filter(pk=image_id).update(variants=variants)
+                processed += 1
+
+        cache.invalidate(cache.CATALOG)
+        self.stdout.write(f"Processed {processed} images, {failed} failed.")
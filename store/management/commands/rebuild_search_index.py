@@ -0,0 +1,16 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from store import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product search index from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        count = search.rebuild_index(batch_size=options["batch_size"])
+        self.stdout.write(f"Indexed {count} products in {perf_counter() - start:.2f}s.")
@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from store.analytics import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the daily sales rollups from the order items. Run with a "
+        "large --days once to backfill existing orders."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=2)
+        parser.add_argument(
+            "--until",
+            type=date.fromisoformat,
+            help="Last day to rebuild (YYYY-MM-DD), yesterday by default",
+        )
+
+    def handle(self, *args, **options):
+        written = reconcile(options["days"], options["until"])
+        self.stdout.write(
+            "Wrote {products} product and {collections} collection rows.".format(
+                **written
+            )
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from store.models import Collection, Product
+
+
+class Command(BaseCommand):
+    help = "Recomputes the stored products_count of every collection"
+
+    def handle(self, *args, **options):
+        actual = Coalesce(
+            Subquery(
+                Product.objects.filter(collection=OuterRef("pk"))
+                .order_by()
+                .values("collection")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        )
+        drifted = Collection.objects.annotate(actual=actual).exclude(
+            products_count=F("actual")
+        )
+        updated = Collection.objects.filter(
+            pk__in=list(drifted.values_list("pk", flat=True))
+        ).update(products_count=actual)
+        self.stdout.write(f"Repaired {updated} collections.")
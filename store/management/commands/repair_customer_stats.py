@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from store.models import Customer
+from store.orders import refresh_customer_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes order_count, lifetime_spend and last_order_at of every "
+        "customer from their orders, archived ones included"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        repaired = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Customer.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            repaired += refresh_customer_stats(Customer.objects.filter(pk__in=ids))
+        self.stdout.write(f"Repaired {repaired} customers.")
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.10 on 2026-10-18 17:31
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_products(apps, schema_editor):
+    Collection = apps.get_model("store", "Collection")
+    Product = apps.get_model("store", "Product")
+    Collection.objects.update(
+        products_count=Coalesce(
+            Subquery(
+                Product.objects.filter(collection=OuterRef("pk"))
+                .order_by()
+                .values("collection")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_taxrate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='products_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
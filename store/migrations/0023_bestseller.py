@@ -0,0 +1,29 @@
+# Generated by Django 4.0.10 on 2026-10-18 17:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_daily_sales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BestSeller',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.PositiveSmallIntegerField()),
+                ('units', models.PositiveBigIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('collection', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.collection')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bestseller',
+            index=models.Index(fields=['window', 'collection', '-units'], name='store_bests_window_44d94f_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.10 on 2026-10-18 17:58
+
+from django.db import migrations, models
+import store.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_customer_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(upload_to='store/images', validators=[store.validators.validate_image_size]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.10 on 2026-10-18 18:21
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+def drop_extra_default_rates(apps, schema_editor):
+    # keep the default that pricing.get_tax_rates() has been applying
+    TaxRate = apps.get_model("store", "TaxRate")
+    defaults = TaxRate.objects.filter(collection__isnull=True).order_by("id")
+    first = defaults.values_list("id", flat=True).first()
+    if first is not None:
+        defaults.exclude(id=first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_alter_productimage_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_extra_default_rates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='taxrate',
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.comparison.Coalesce(
+                    'collection', models.Value(0)
+                ),
+                name='unique_default_tax_rate',
+            ),
+        ),
+    ]
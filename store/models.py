@@ -5,10 +5,11 @@ from django.contrib import admin
 from django.core import validators
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import constraints
+from django.db.models import Value, constraints
 from django.db.models.deletion import CASCADE, SET_NULL
 from django.db.models.fields import EmailField
 from django.db.models.fields.related import ForeignKey
+from django.db.models.functions import Coalesce
 from rest_framework import permissions
 
 from store.validators import validate_image_size
@@ -24,6 +25,8 @@ class Promotion(models.Model):
 
 class Collection(models.Model):
     title = models.CharField(max_length=255)
+    # maintained by store.signals.handlers, repaired by recount_collections
+    products_count = models.PositiveIntegerField(default=0, db_index=True)
     featured_product = models.ForeignKey(
         "Product", on_delete=models.SET_NULL, null=True, related_name="+"
     )
@@ -55,6 +58,32 @@ class Product(models.Model):
         ordering = ["title"]
 
 
+class TaxRate(models.Model):
+    # a row without a collection is the default rate for every other collection
+    collection = models.OneToOneField(
+        Collection,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="tax_rate",
+    )
+    rate = models.DecimalField(
+        max_digits=5, decimal_places=4, validators=[MinValueValidator(0)]
+    )
+
+    class Meta:
+        constraints = [
+            # one default row: NULL collections map to 0, which no collection
+            # id uses. Not a conditional constraint, which MySQL would ignore.
+            models.UniqueConstraint(
+                Coalesce("collection", Value(0)), name="unique_default_tax_rate"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.collection or 'Default'}: {self.rate}"
+
+
 class ProductImage(models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name="images"
@@ -62,6 +91,8 @@ class ProductImage(models.Model):
     image = models.ImageField(
         upload_to="store/images", validators=[validate_image_size]
     )
+    # {variant: {format: storage name}}, filled in by store.tasks
+    variants = models.JSONField(default=dict, blank=True)
 
 
 class Customer(models.Model):
@@ -85,6 +116,12 @@ class Customer(models.Model):
         max_length=1, choices=MEMBERSHIP_CHOICES, default=MEMBORSHIP_BRONZE
     )
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # maintained by checkout, see store.orders.refresh_customer_stats
+    order_count = models.PositiveIntegerField(default=0, db_index=True)
+    lifetime_spend = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0, db_index=True
+    )
+    last_order_at = models.DateTimeField(null=True, db_index=True)
 
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name}"
@@ -116,11 +153,42 @@ class Order(models.Model):
         max_length=1, choices=PAYMENT_STATUS, default=PAYMENT_STATUS_PENDING
     )
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    # denormalized from the items at checkout, see store.orders
+    total_price = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, db_index=True
+    )
+    item_count = models.PositiveIntegerField(default=0, db_index=True)
 
     class Meta:
         permissions = [("cancel_order", "can cancel order")]
 
 
+class Checkout(models.Model):
+    """An asynchronous checkout of a cart, placed by store.tasks.place_order."""
+
+    STATUS_PENDING = "pending"
+    STATUS_COMPLETE = "complete"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_COMPLETE, "Complete"),
+        (STATUS_FAILED, "Failed"),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid4)
+    # one checkout per cart makes the task idempotent on the cart id
+    cart_id = models.UUIDField(unique=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    status = models.CharField(
+        max_length=8, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    order = models.OneToOneField(
+        Order, on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name="items")
     product = models.ForeignKey(
@@ -130,6 +198,34 @@ class OrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
 
+class ArchivedOrder(models.Model):
+    """
+    A completed order moved out of Order by store.orders.archive_orders().
+    Keeps the original id and columns.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    placed_at = models.DateTimeField()
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS)
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2)
+    item_count = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["customer", "placed_at"])]
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(
+        ArchivedOrder, on_delete=models.PROTECT, related_name="items"
+    )
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name="+")
+    quantity = models.PositiveBigIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+
+
 class Address(models.Model):
     street = models.CharField(max_length=255)
     city = models.CharField(max_length=255)
@@ -140,7 +236,7 @@ class Address(models.Model):
 
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
 
 class CartItem(models.Model):
@@ -159,3 +255,61 @@ class Reviews(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     date = models.DateTimeField(auto_now_add=True)
+
+
+class ProductSearchTerm(models.Model):
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="search_terms"
+    )
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        # leads with term, so it also serves the prefix lookups in store.search
+        unique_together = [["term", "product"]]
+
+
+class ProductDailySales(models.Model):
+    """Units, revenue and orders per product per day, see store.analytics."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    date = models.DateField()
+    units = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [["product", "date"]]
+        indexes = [models.Index(fields=["date"])]
+
+
+class CollectionDailySales(models.Model):
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, related_name="+"
+    )
+    date = models.DateField()
+    units = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [["collection", "date"]]
+        indexes = [models.Index(fields=["date"])]
+
+
+class BestSeller(models.Model):
+    """
+    The top products by units sold over the last `window` days, overall
+    (collection is null) and per collection. See store.analytics.
+    """
+
+    window = models.PositiveSmallIntegerField()
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, null=True, related_name="+"
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    units = models.PositiveBigIntegerField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        indexes = [models.Index(fields=["window", "collection", "-units"])]
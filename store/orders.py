@@ -0,0 +1,220 @@
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from time import perf_counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    IntegerField,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from store.models import ArchivedOrder, ArchivedOrderItem, Customer, Order, OrderItem
+
+"""
+Order.total_price and Order.item_count (units ordered) are written by
+checkout together with the items. refresh_totals() recomputes them from
+OrderItem for orders whose items changed afterwards (admin edits,
+imports), and backs the backfill_order_totals command.
+
+archive_orders() moves completed orders past STORE_ORDER_ARCHIVE_AGE days
+into ArchivedOrder/ArchivedOrderItem, so Order and OrderItem only hold
+recent orders. Only the customer order history reads the archive.
+
+Customer.order_count, lifetime_spend and last_order_at are bumped by
+checkout (record_customer_order) and recomputed over hot and archived
+orders by refresh_customer_stats() and the repair_customer_stats command.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _items_sum(expression, output_field):
+    return Coalesce(
+        Subquery(
+            OrderItem.objects.filter(order=OuterRef("pk"))
+            .order_by()
+            .values("order")
+            .annotate(total=Sum(expression, output_field=output_field))
+            .values("total")
+        ),
+        Decimal(0) if isinstance(output_field, DecimalField) else 0,
+        output_field=output_field,
+    )
+
+
+def actual_totals():
+    return {
+        "total_price": _items_sum(
+            F("quantity") * F("unit_price"),
+            DecimalField(max_digits=12, decimal_places=2),
+        ),
+        "item_count": _items_sum(F("quantity"), IntegerField()),
+    }
+
+
+def totals_for(items):
+    """(total_price, item_count) of unsaved OrderItems."""
+    return (
+        sum((item.quantity * item.unit_price for item in items), Decimal(0)),
+        sum(item.quantity for item in items),
+    )
+
+
+def refresh_totals(queryset):
+    """Rewrites the stored totals of the orders that drifted; returns the count."""
+    totals = actual_totals()
+    drifted = (
+        queryset.annotate(
+            actual_price=totals["total_price"], actual_count=totals["item_count"]
+        )
+        .exclude(total_price=F("actual_price"), item_count=F("actual_count"))
+        .values_list("pk", flat=True)
+    )
+    return Order.objects.filter(pk__in=list(drifted)).update(**totals)
+
+
+def record_customer_order(order):
+    """Adds a new order to its customer's stats, in the checkout transaction."""
+    Customer.objects.filter(pk=order.customer_id).update(
+        order_count=F("order_count") + 1,
+        lifetime_spend=F("lifetime_spend") + order.total_price,
+        last_order_at=order.placed_at,
+    )
+
+
+def _customer_orders(model, aggregate, output_field):
+    return Subquery(
+        model.objects.filter(customer=OuterRef("pk"))
+        .order_by()
+        .values("customer")
+        .annotate(value=aggregate)
+        .values("value"),
+        output_field=output_field,
+    )
+
+
+def actual_customer_stats():
+    """Stats over hot and archived orders; an order is in one or the other."""
+    spend = DecimalField(max_digits=14, decimal_places=2)
+    counts = [
+        Coalesce(_customer_orders(model, Count("id"), IntegerField()), 0)
+        for model in [Order, ArchivedOrder]
+    ]
+    spends = [
+        Coalesce(_customer_orders(model, Sum("total_price"), spend), Decimal(0))
+        for model in [Order, ArchivedOrder]
+    ]
+    hot_last, archived_last = [
+        _customer_orders(
+            model, Max("placed_at"), Customer._meta.get_field("last_order_at")
+        )
+        for model in [Order, ArchivedOrder]
+    ]
+    return {
+        "order_count": counts[0] + counts[1],
+        "lifetime_spend": ExpressionWrapper(spends[0] + spends[1], output_field=spend),
+        # GREATEST is NULL on MySQL as soon as one side is
+        "last_order_at": Coalesce(
+            Greatest(hot_last, archived_last), hot_last, archived_last
+        ),
+    }
+
+
+def refresh_customer_stats(queryset):
+    """Rewrites the stored stats of the customers that drifted; returns the count."""
+    stats = actual_customer_stats()
+    drifted = (
+        queryset.annotate(
+            actual_count=stats["order_count"],
+            actual_spend=stats["lifetime_spend"],
+            actual_last=stats["last_order_at"],
+        )
+        .exclude(
+            Q(order_count=F("actual_count"), lifetime_spend=F("actual_spend"))
+            & (
+                Q(last_order_at=F("actual_last"))
+                | Q(last_order_at__isnull=True, actual_last__isnull=True)
+            )
+        )
+        .values_list("pk", flat=True)
+    )
+    return Customer.objects.filter(pk__in=list(drifted)).update(**stats)
+
+
+def _copy(instance, model):
+    return model(
+        **{
+            field.attname: getattr(instance, field.attname)
+            for field in instance._meta.concrete_fields
+        }
+    )
+
+
+def archive_orders(max_age=None, batch_size=None):
+    """
+    Moves completed orders placed more than max_age days ago to the archive
+    tables, batch_size orders per transaction in primary key order. Orders
+    locked by another transaction are left for the next run. Returns the
+    totals.
+    """
+    if max_age is None:
+        max_age = getattr(settings, "STORE_ORDER_ARCHIVE_AGE", 365)
+    if batch_size is None:
+        batch_size = getattr(settings, "STORE_ORDER_ARCHIVE_BATCH_SIZE", 500)
+    candidates = Order.objects.filter(
+        payment_status=Order.PAYMENT_STATUS_COMPLETE,
+        placed_at__lt=timezone.now() - timedelta(days=max_age),
+    )
+    stats = {"batches": 0, "orders": 0, "items": 0, "seconds": 0.0}
+    last_id = 0
+    while True:
+        ids = list(
+            candidates.filter(pk__gt=last_id)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        start = perf_counter()
+        with transaction.atomic():
+            orders = list(
+                candidates.select_for_update(skip_locked=True).filter(pk__in=ids)
+            )
+            items = list(OrderItem.objects.filter(order__in=orders))
+            ArchivedOrder.objects.bulk_create(
+                _copy(order, ArchivedOrder) for order in orders
+            )
+            ArchivedOrderItem.objects.bulk_create(
+                _copy(item, ArchivedOrderItem) for item in items
+            )
+            OrderItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+            Order.objects.filter(pk__in=[order.pk for order in orders]).delete()
+        seconds = perf_counter() - start
+
+        stats["batches"] += 1
+        stats["orders"] += len(orders)
+        stats["items"] += len(items)
+        stats["seconds"] += seconds
+        logger.info(
+            "Archived %d orders and %d items in %.3fs", len(orders), len(items), seconds
+        )
+    logger.info(
+        "Order archival: %(orders)d orders and %(items)d items "
+        "in %(batches)d batches, %(seconds).3fs",
+        stats,
+    )
+    return stats
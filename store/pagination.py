@@ -1,5 +1,253 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
+
+
+def _encode_value(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over the queryset's current ordering with id as
+    a tie-breaker, so every page is a bounded index range scan instead of
+    COUNT(*) + OFFSET.
+
+    Keyset mode is enabled by the cursor query parameter (empty for the
+    first page); without it the request falls back to fallback_class, or is
+    left unpaginated. Ordering fields must be non-nullable. Pass total=true
+    to get an approximate count.
+    """
+
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    total_query_param = "total"
+    total_count_cap = 10000
+    default_ordering = ["-id"]
+    fallback_class = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None
+        if self.cursor_query_param not in request.query_params:
+            if self.fallback_class is None:
+                return None
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        queryset = queryset.order_by(*self.ordering)
+        self.total = self.get_total(queryset, request)
+
+        cursor = self.decode_cursor(request, queryset)
+        rows = list(self.seek(queryset, cursor)[: self.page_size + 1])
+        return self.build_page(rows, cursor)
+
+    def seek(self, queryset, cursor):
+        """The rows after the cursor, in the order they are fetched in."""
+        if cursor is None:
+            return queryset
+        values, reverse = cursor
+        queryset = queryset.filter(self.get_keyset_filter(values, reverse))
+        return queryset.reverse() if reverse else queryset
+
+    def build_page(self, rows, cursor):
+        """Takes up to page_size + 1 rows from seek() and sets up the links."""
+        reverse = cursor is not None and cursor[1]
+        has_more = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+
+        response = OrderedDict()
+        if self.total is not None:
+            response["count"], response["count_is_approximate"] = self.total
+        response["next"] = self.get_next_link()
+        response["previous"] = self.get_previous_link()
+        response["results"] = data
+        return Response(response)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = list(
+            queryset.query.order_by
+            or queryset.model._meta.ordering
+            or self.default_ordering
+        )
+        if not any(field.lstrip("-") in ("id", "pk") for field in ordering):
+            ordering.append("id")
+        return ordering
+
+    def get_keyset_filter(self, values, reverse):
+        """
+        Rows strictly after (or before, when reverse) the cursor position:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND id > z) ...
+        """
+        keyset = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            descending = field.startswith("-") != reverse
+            lookup = "lt" if descending else "gt"
+            keyset |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return keyset
+
+    def get_total(self, queryset, request):
+        if request.query_params.get(self.total_query_param) not in ("1", "true"):
+            return None
+        if not queryset.query.where:
+            estimate = self.estimate_table_rows(queryset.model)
+            if estimate is not None:
+                return estimate, True
+        capped = queryset.order_by()[: self.total_count_cap + 1].count()
+        return min(capped, self.total_count_cap), capped > self.total_count_cap
+
+    def estimate_table_rows(self, model):
+        table = model._meta.db_table
+        if connection.vendor == "mysql":
+            sql = (
+                "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+            )
+        elif connection.vendor == "postgresql":
+            sql = "SELECT reltuples::bigint FROM pg_class WHERE relname = %s"
+        else:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+
+    def get_value(self, instance, field):
+        value = instance
+        for part in field.lstrip("-").split("__"):
+            part = "id" if part == "pk" else part
+            # rows are model instances, or dicts on values() querysets
+            value = value[part] if isinstance(value, dict) else getattr(value, part)
+        return value
+
+    def get_position(self, instance):
+        return [
+            _encode_value(self.get_value(instance, field)) for field in self.ordering
+        ]
+
+    def get_field(self, queryset, name):
+        """The model field, or annotation output field, behind an ordering."""
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model, parts = queryset.model, name.split("__")
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).related_model
+        return model._meta.get_field("id" if parts[-1] == "pk" else parts[-1])
+
+    def encode_cursor(self, values, reverse):
+        # the ordering is kept so a cursor can't be replayed against another
+        payload = json.dumps({"o": self.ordering, "v": values, "r": reverse}).encode()
+        cursor = urlsafe_b64encode(payload).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()))
+            ordering, values, reverse = payload["o"], payload["v"], bool(payload["r"])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound("Invalid cursor")
+        if (
+            ordering != self.ordering
+            or not isinstance(values, list)
+            or len(values) != len(self.ordering)
+        ):
+            raise NotFound("Invalid cursor")
+        try:
+            values = [
+                self.get_field(queryset, field.lstrip("-")).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+        # ordering fields are non-nullable
+        if None in values:
+            raise NotFound("Invalid cursor")
+        return values, reverse
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), True)
+
+
+class CatalogPagination(KeysetPagination):
+    fallback_class = DefaultPagination
+
+
+class MergedKeysetPagination(KeysetPagination):
+    """
+    Keyset pagination over several querysets with the same ordering, such
+    as hot and archived orders, merged in Python. Each source is asked for
+    one page past the cursor, so a page costs one bounded query per source.
+    Always paginates; the first page needs no cursor. No total.
+    """
+
+    def paginate_queryset(self, querysets, request, view=None):
+        self.fallback = None
+        self.total = None
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(querysets[0])
+
+        cursor = self.decode_cursor(request, querysets[0])
+        reverse = cursor is not None and cursor[1]
+        rows = []
+        for queryset in querysets:
+            queryset = queryset.order_by(*self.ordering)
+            rows += self.seek(queryset, cursor)[: self.page_size + 1]
+        # stable sorts, least significant field first, in fetch order
+        for field in reversed(self.ordering):
+            rows.sort(
+                key=lambda row: self.get_value(row, field),
+                reverse=field.startswith("-") != reverse,
+            )
+        return self.build_page(rows[: self.page_size + 1], cursor)
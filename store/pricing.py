@@ -0,0 +1,92 @@
+from decimal import ROUND_HALF_UP, Decimal
+from time import monotonic
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, F, Value, When
+from django.db.models.functions import Round
+
+from store import cache
+from store.models import TaxRate
+
+"""
+Tax-inclusive pricing computed by the database.
+
+Tax rates live in the TaxRate table (one optional row per collection plus
+a default row) and are cached in-process, so annotating a queryset costs
+no extra query: the rates are inlined as a CASE over collection_id.
+
+Each process tags its copy with a version kept in the shared store cache;
+clear_cache() bumps it, so every process reloads on its next use rather
+than pricing (and caching responses) with stale rates. Copies are also
+reloaded after STORE_TAX_RATE_CACHE_TIMEOUT seconds.
+"""
+
+CENT = Decimal("0.01")
+TAX_RATES = "tax-rates"
+
+_rates = None
+_version = None
+_loaded_at = 0.0
+
+
+def clear_cache():
+    """Makes every process reload its tax rates on next use."""
+    global _rates
+    _rates = None
+    cache.invalidate(TAX_RATES)
+
+
+def get_tax_rates():
+    """Returns (default_rate, {collection_id: rate})."""
+    global _rates, _version, _loaded_at
+    timeout = getattr(settings, "STORE_TAX_RATE_CACHE_TIMEOUT", 60)
+    # read before loading: a change committed meanwhile bumps it again
+    version = cache.get_version(TAX_RATES)
+    if _rates is None or version != _version or monotonic() - _loaded_at > timeout:
+        default = Decimal(getattr(settings, "STORE_DEFAULT_TAX_RATE", "0.1"))
+        by_collection = {}
+        for collection_id, rate in TaxRate.objects.order_by("-id").values_list(
+            "collection_id", "rate"
+        ):
+            if collection_id is None:
+                default = rate
+            else:
+                by_collection[collection_id] = rate
+        _rates = (default, by_collection)
+        _version = version
+        _loaded_at = monotonic()
+    return _rates
+
+
+def get_tax_rate(collection_id):
+    default, by_collection = get_tax_rates()
+    return by_collection.get(collection_id, default)
+
+
+def price_with_tax(unit_price, collection_id):
+    # half up, like ROUND() on a DECIMAL in MySQL and PostgreSQL
+    return (unit_price * (1 + get_tax_rate(collection_id))).quantize(
+        CENT, rounding=ROUND_HALF_UP
+    )
+
+
+def price_with_tax_expression():
+    default, by_collection = get_tax_rates()
+    multiplier_field = DecimalField(max_digits=6, decimal_places=4)
+    multiplier = Case(
+        *[
+            When(collection_id=collection_id, then=Value(1 + rate))
+            for collection_id, rate in by_collection.items()
+        ],
+        default=Value(1 + default),
+        output_field=multiplier_field,
+    )
+    return Round(
+        F("unit_price") * multiplier,
+        2,
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def annotate_price_with_tax(queryset):
+    return queryset.annotate(price_with_tax=price_with_tax_expression())
@@ -0,0 +1,101 @@
+import re
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+
+from store.models import Product, ProductSearchTerm
+
+"""
+Inverted index over Product title and description.
+
+Every product owns one ProductSearchTerm row per distinct token, weighted by
+where the token occurs (title occurrences count more than description
+ones). Queries resolve against the indexed term column with prefix matches,
+so they never scan the products table.
+"""
+
+TITLE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+MAX_TERM_LENGTH = 64
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.lower())]
+
+
+def build_terms(product: Product):
+    weights = Counter()
+    for token in tokenize(product.title):
+        weights[token] += TITLE_WEIGHT
+    for token in tokenize(product.description):
+        weights[token] += DESCRIPTION_WEIGHT
+    return [
+        ProductSearchTerm(term=term, product_id=product.id, weight=weight)
+        for term, weight in weights.items()
+    ]
+
+
+def index_product(product: Product):
+    index_products([product])
+
+
+def index_products(products, batch_size=2000):
+    terms = [term for product in products for term in build_terms(product)]
+    with transaction.atomic():
+        ProductSearchTerm.objects.filter(
+            product_id__in=[product.id for product in products]
+        ).delete()
+        ProductSearchTerm.objects.bulk_create(terms, batch_size=batch_size)
+
+
+def rebuild_index(batch_size=2000):
+    # Batches commit independently so a full rebuild never holds one huge
+    # transaction; searches return partial results until it finishes.
+    ProductSearchTerm.objects.all().delete()
+    products = Product.objects.only("id", "title", "description").order_by("id")
+    terms = []
+    count = 0
+    for product in products.iterator(chunk_size=batch_size):
+        terms.extend(build_terms(product))
+        count += 1
+        if len(terms) >= batch_size:
+            ProductSearchTerm.objects.bulk_create(terms, batch_size=batch_size)
+            terms = []
+    ProductSearchTerm.objects.bulk_create(terms, batch_size=batch_size)
+    return count
+
+
+def search(queryset, text):
+    """
+    Restricts the queryset to products matching every token of text (as a
+    prefix) and annotates it with search_rank, highest first.
+    """
+    tokens = list(dict.fromkeys(tokenize(text)))
+    if not tokens:
+        return queryset
+
+    matches = Q()
+    for token in tokens:
+        matches |= Q(term__startswith=token)
+
+    per_token = {
+        f"matched_{index}": Count("id", filter=Q(term__startswith=token))
+        for index, token in enumerate(tokens)
+    }
+    hits = (
+        ProductSearchTerm.objects.filter(matches)
+        .values("product_id")
+        .annotate(rank=Sum("weight"), **per_token)
+        .filter(**{f"{name}__gt": 0 for name in per_token})
+    )
+    rank = Subquery(hits.filter(product_id=OuterRef("pk")).values("rank")[:1])
+    return (
+        queryset.filter(pk__in=hits.values("product_id"))
+        .annotate(search_rank=rank)
+        .order_by("-search_rank", "id")
+    )
@@ -1,29 +1,96 @@
+from collections import defaultdict
+from datetime import timedelta
 from decimal import Decimal
 
 from core import models
 from core.serializers import SimpleUserSerializer
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 from rest_framework.fields import ReadOnlyField
 from rest_framework.relations import HyperlinkedRelatedField
 from typing_extensions import Required
 
 from store.models import (
+    ArchivedOrder,
+    BestSeller,
     Cart,
     CartItem,
+    Checkout,
     Collection,
+    CollectionDailySales,
     Customer,
     Order,
     OrderItem,
     Product,
+    ProductDailySales,
     ProductImage,
     Reviews,
 )
 
+from . import carts, inventory, orders, pricing, tasks
+from .carts import get_cart_storage
+from .images import variant_urls
 from .signals import order_created
 
 
+class SparseFieldsMixin:
+    """
+    ?fields=a,b limits the output to the listed fields. Relations in
+    expandable_fields are only included when listed in fields or expand.
+    Without ?fields= every field is returned.
+
+    optimize_queryset() applies the same selection to the queryset:
+    field_queries maps a field to the only() columns, select_related and
+    prefetch_related lookups it needs (a model field defaults to itself),
+    so unrequested columns are deferred and relations never loaded.
+    """
+
+    expandable_fields = []
+    field_queries = {}
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        fields = request.query_params.get("fields") if request is not None else None
+        if not fields:
+            return None
+        requested = set(fields.split(","))
+        expand = set(request.query_params.get("expand", "").split(","))
+        requested |= expand & set(cls.expandable_fields)
+        return requested & set(cls.Meta.fields)
+
+    @classmethod
+    def optimize_queryset(cls, queryset, request):
+        requested = cls.get_requested_fields(request)
+        if requested is None:
+            return queryset
+        only, select_related, prefetch_related = {"id"}, [], []
+        for name in requested:
+            query = cls.field_queries.get(name, {"only": [name]})
+            only.update(query.get("only", []))
+            select_related += query.get("select_related", [])
+            prefetch_related += query.get("prefetch_related", [])
+        return (
+            queryset.select_related(None)
+            .prefetch_related(None)
+            .select_related(*select_related)
+            # several fields can share a lookup; Prefetch compares by path
+            .prefetch_related(*dict.fromkeys(prefetch_related))
+            .only(*only)
+        )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.get_requested_fields(self.context.get("request"))
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
 class CollectionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Collection
@@ -33,9 +100,14 @@ class CollectionSerializer(serializers.ModelSerializer):
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField(method_name="get_variants")
+
     class Meta:
         model = ProductImage
-        fields = ["id", "image"]
+        fields = ["id", "image", "variants"]
+
+    def get_variants(self, product_image: ProductImage):
+        return variant_urls(product_image.variants, self.context.get("request"))
 
     def create(self, validated_data):
         product_id = self.context["product_id"]
@@ -43,9 +115,16 @@ class ProductImageSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
 
+    expandable_fields = ["images"]
+    field_queries = {
+        "price_with_tax": {"only": ["unit_price", "collection_id"]},
+        "collection": {"only": ["collection_id"]},
+        "images": {"prefetch_related": ["images"]},
+    }
+
     class Meta:
         model = Product
         # fields = "__all__" # bad practice
@@ -82,7 +161,11 @@ class ProductSerializer(serializers.ModelSerializer):
     # )
 
     def calculate_tax(self, product: Product):
-        return product.unit_price * Decimal(1.1)
+        # annotated by pricing.annotate_price_with_tax on list/detail querysets
+        price = getattr(product, "price_with_tax", None)
+        if price is None:
+            price = pricing.price_with_tax(product.unit_price, product.collection_id)
+        return price
 
     # override the validate method of the ModelSerializer class to perform custom validation.
     # def validate(self, attrs):
@@ -95,6 +178,12 @@ class ProductSerializer(serializers.ModelSerializer):
         product.save()
         return product
 
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # the annotated price_with_tax is stale once unit_price or collection change
+        instance.__dict__.pop("price_with_tax", None)
+        return instance
+
     # similary update method can also be overridden
     # def update(self, instance, validated_data):
     # in    stance.unit_price = validated_data.get("unit_price")
@@ -102,6 +191,108 @@ class ProductSerializer(serializers.ModelSerializer):
     # return instance
 
 
+class ProductRowSerializer:
+    """
+    Fast path for product lists: builds ProductSerializer's JSON shape from
+    values() rows and one batched images query, without model instances or
+    per-field serializer calls. Only for reads.
+    """
+
+    def __init__(self, rows, many=True, context=None):
+        self.rows = rows
+        self.context = context or {}
+        self.requested = ProductSerializer.get_requested_fields(
+            self.context.get("request")
+        )
+
+    def image_url(self, name):
+        if not name:
+            return None
+        url = ProductImage._meta.get_field("image").storage.url(name)
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def price_with_tax(self, row):
+        price = row.get("price_with_tax")
+        if price is None:
+            price = pricing.price_with_tax(row["unit_price"], row["collection_id"])
+        return price
+
+    def get_images(self, rows):
+        product_images = defaultdict(list)
+        for image in ProductImage.objects.filter(
+            product_id__in=[row["id"] for row in rows]
+        ).values("id", "product_id", "image", "variants"):
+            product_images[image["product_id"]].append(
+                {
+                    "id": image["id"],
+                    "image": self.image_url(image["image"]),
+                    "variants": variant_urls(
+                        image["variants"], self.context.get("request")
+                    ),
+                }
+            )
+        return product_images
+
+    def is_requested(self, name):
+        return self.requested is None or name in self.requested
+
+    @property
+    def data(self):
+        rows = list(self.rows)
+        product_images = self.get_images(rows) if self.is_requested("images") else {}
+        data = []
+        for row in rows:
+            product = {
+                "id": row["id"],
+                "title": row.get("title"),
+                "slug": row.get("slug"),
+                "description": row.get("description"),
+                "inventory": row.get("inventory"),
+                "unit_price": row.get("unit_price"),
+                "price_with_tax": (
+                    self.price_with_tax(row)
+                    if self.is_requested("price_with_tax")
+                    else None
+                ),
+                "collection": row.get("collection_id"),
+                "images": product_images.get(row["id"], []),
+            }
+            if self.requested is not None:
+                product = {
+                    name: value
+                    for name, value in product.items()
+                    if name in self.requested
+                }
+            data.append(product)
+        return data
+
+
+class ProductImportSerializer(serializers.ModelSerializer):
+    """
+    Validates one row of a bulk import. Collections are checked against
+    context["collection_ids"] so validation issues no queries.
+    """
+
+    collection = serializers.IntegerField(source="collection_id")
+
+    class Meta:
+        model = Product
+        fields = [
+            "title",
+            "slug",
+            "description",
+            "unit_price",
+            "inventory",
+            "collection",
+        ]
+
+    def validate_collection(self, value):
+        if value not in self.context["collection_ids"]:
+            raise serializers.ValidationError("The collection does not exist.")
+        return value
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reviews
@@ -137,28 +328,71 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         producd_id = self.validated_data["product_id"]
         quantity = self.validated_data["quantity"]
         try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=producd_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data
-            )
+            self.instance = get_cart_storage().add_item(cart_id, producd_id, quantity)
+        except Cart.DoesNotExist:
+            raise NotFound("The cart does not exist with the given id.")
         return self.instance
 
 
+class CartItemOperationSerializer(serializers.Serializer):
+    OPERATION_CHOICES = [carts.ADD, carts.SET, carts.REMOVE]
+
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, required=False)
+    operation = serializers.ChoiceField(choices=OPERATION_CHOICES, default=carts.ADD)
+
+    def validate(self, attrs):
+        if attrs["operation"] != carts.REMOVE and "quantity" not in attrs:
+            raise serializers.ValidationError(
+                {"quantity": "This field is required for add and set."}
+            )
+        return attrs
+
+
+class BatchCartItemSerializer(serializers.Serializer):
+    operations = CartItemOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, operations):
+        product_ids = {operation["product_id"] for operation in operations}
+        existing = set(
+            Product.objects.filter(pk__in=product_ids).values_list("id", flat=True)
+        )
+        missing = sorted(product_ids - existing)
+        if missing:
+            raise serializers.ValidationError(
+                f"The products do not exist with the given product_ids: {missing}."
+            )
+        return operations
+
+    def save(self, **kwargs):
+        try:
+            get_cart_storage().apply_operations(
+                self.context["cart_id"], self.validated_data["operations"]
+            )
+        except Cart.DoesNotExist:
+            raise NotFound("The cart does not exist with the given id.")
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ["quantity"]
 
+    def update(self, instance, validated_data):
+        try:
+            return get_cart_storage().set_quantity(instance, validated_data["quantity"])
+        except CartItem.DoesNotExist:
+            raise NotFound("The cart item does not exist with the given id.")
+
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
     total_price = serializers.SerializerMethodField(method_name="get_total_price")
 
     def get_total_price(self, cart_item: CartItem):
+        total_price = getattr(cart_item, "total_price", None)
+        if total_price is not None:
+            return total_price
         return cart_item.quantity * cart_item.product.unit_price
 
     class Meta:
@@ -166,13 +400,22 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ["id", "product", "quantity", "total_price"]
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField(method_name="get_total_price")
 
-    def get_total_price(self, cart: Cart):
+    expandable_fields = ["items"]
+    field_queries = {
+        "items": {"prefetch_related": ["items__product"]},
+        # annotated by carts.with_totals()
+        "total_price": {},
+    }
 
+    def get_total_price(self, cart: Cart):
+        total_price = getattr(cart, "total_price", None)
+        if total_price is not None:
+            return total_price
         return sum(
             [item.quantity * item.product.unit_price for item in cart.items.all()]
         )
@@ -182,6 +425,22 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ["id", "items", "total_price"]
 
 
+def order_items_prefetch(lookup="items", model=OrderItem):
+    """Order items with just the product columns OrderItemSerializer shows."""
+    return Prefetch(
+        lookup,
+        queryset=model.objects.select_related("product").only(
+            "id",
+            "order_id",
+            "quantity",
+            "unit_price",
+            "product__id",
+            "product__title",
+            "product__unit_price",
+        ),
+    )
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
     total_price = serializers.SerializerMethodField(method_name="get_total_price")
@@ -197,23 +456,58 @@ class OrderItemSerializer(serializers.ModelSerializer):
 class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer
-        fields = ["id", "first_name", "last_name"]
+        fields = [
+            "id",
+            "first_name",
+            "last_name",
+            "order_count",
+            "lifetime_spend",
+            "last_order_at",
+        ]
+        # maintained by checkout
+        read_only_fields = ["order_count", "lifetime_spend", "last_order_at"]
 
 
 class CustomerProfileSerializer(CustomerSerializer):
     user = SimpleUserSerializer()
 
     class Meta(CustomerSerializer.Meta):
-        fields = ["id", "user", "phone", "membership", "birth_date"]
+        fields = [
+            "id",
+            "user",
+            "phone",
+            "membership",
+            "birth_date",
+            "order_count",
+            "lifetime_spend",
+            "last_order_at",
+        ]
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     customer = CustomerSerializer()
     items = OrderItemSerializer(many=True)
     total_order_price = serializers.SerializerMethodField(
         method_name="get_total_order_price"
     )
 
+    expandable_fields = ["customer", "items"]
+    field_queries = {
+        "customer": {
+            "only": [
+                "customer__id",
+                "customer__order_count",
+                "customer__lifetime_spend",
+                "customer__last_order_at",
+                "customer__user__first_name",
+                "customer__user__last_name",
+            ],
+            "select_related": ["customer__user"],
+        },
+        "items": {"prefetch_related": [order_items_prefetch()]},
+        "total_order_price": {"only": ["total_price"]},
+    }
+
     class Meta:
         model = Order
         fields = [
@@ -222,22 +516,36 @@ class OrderSerializer(serializers.ModelSerializer):
             "placed_at",
             "payment_status",
             "items",
+            "item_count",
             "total_order_price",
         ]
 
     def get_total_order_price(self, order: Order):
-        return sum([item.quantity * item.unit_price for item in order.items.all()])
+        return order.total_price
+
+
+class OrderHistorySerializer(OrderSerializer):
+    """Orders and ArchivedOrders, which have the same fields."""
+
+    archived = serializers.SerializerMethodField()
+
+    class Meta(OrderSerializer.Meta):
+        fields = OrderSerializer.Meta.fields + ["archived"]
+
+    def get_archived(self, order):
+        return isinstance(order, ArchivedOrder)
 
 
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        storage = get_cart_storage()
+        if not storage.cart_exists(cart_id):
             raise serializers.ValidationError(
                 "The card does not exist with the given id."
             )
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if storage.count_items(cart_id) == 0:
             raise serializers.ValidationError("The cart is empty.")
 
         return cart_id
@@ -245,28 +553,144 @@ class CreateOrderSerializer(serializers.Serializer):
     def save(self, **kwargs):
         cart_id = self.validated_data["cart_id"]
         user_id = self.context["user_id"]
+        try:
+            return inventory.retry_on_deadlock(self.create_order, cart_id, user_id)
+        except inventory.InsufficientStock as error:
+            raise serializers.ValidationError({"cart_id": error.messages})
+
+    def create_order(self, cart_id, user_id):
+        storage = get_cart_storage()
         with transaction.atomic():
-            customer = Customer.objects.get(pk=user_id)
-            order = Order.objects.create(customer=customer)
-            cart_items = CartItem.objects.select_related("product").filter(
-                cart_id=cart_id
+            storage.materialize(cart_id)
+            # the lock keeps the abandoned-cart sweeper off this cart
+            if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+                raise serializers.ValidationError(
+                    {"cart_id": ["The cart does not exist with the given id."]}
+                )
+            customer = Customer.objects.get(user_id=user_id)
+            cart_items = list(
+                CartItem.objects.select_related("product").filter(cart_id=cart_id)
             )
+            if not cart_items:
+                raise serializers.ValidationError({"cart_id": ["The cart is empty."]})
+            inventory.reserve({item.product_id: item.quantity for item in cart_items})
             order_items = [
                 OrderItem(
-                    order=order,
                     product=item.product,
                     quantity=item.quantity,
                     unit_price=item.product.unit_price,
                 )
                 for item in cart_items
             ]
+            total_price, item_count = orders.totals_for(order_items)
+            order = Order.objects.create(
+                customer=customer, total_price=total_price, item_count=item_count
+            )
+            for order_item in order_items:
+                order_item.order = order
             OrderItem.objects.bulk_create(order_items)
+            orders.record_customer_order(order)
             Cart.objects.filter(pk=cart_id).delete()
+            transaction.on_commit(lambda: storage.delete_cart(cart_id))
             order_created.send_robust(self.__class__, order=order)
             return order
 
 
+class CreateCheckoutSerializer(CreateOrderSerializer):
+    """
+    Queues the order instead of placing it. Posting the same cart again
+    returns its checkout, and retries it if it failed or has been pending
+    for longer than STORE_CHECKOUT_STALE_AFTER seconds (its task was lost).
+    """
+
+    def validate_cart_id(self, cart_id):
+        checkout = Checkout.objects.filter(cart_id=cart_id).first()
+        if checkout is None:
+            return super().validate_cart_id(cart_id)
+        if checkout.customer.user_id != self.context["user_id"]:
+            raise serializers.ValidationError(
+                "The card does not exist with the given id."
+            )
+        return cart_id
+
+    def save(self, **kwargs):
+        cart_id = self.validated_data["cart_id"]
+        customer = Customer.objects.get(user_id=self.context["user_id"])
+        checkout, queued = Checkout.objects.get_or_create(
+            cart_id=cart_id, defaults={"customer": customer}
+        )
+        if not queued:
+            stale = timezone.now() - timedelta(
+                seconds=getattr(settings, "STORE_CHECKOUT_STALE_AFTER", 10 * 60)
+            )
+            # conditional, so concurrent retries queue the task only once
+            queued = (
+                Checkout.objects.filter(pk=checkout.pk)
+                .filter(
+                    Q(status=Checkout.STATUS_FAILED)
+                    | Q(status=Checkout.STATUS_PENDING, updated_at__lt=stale)
+                )
+                .update(
+                    status=Checkout.STATUS_PENDING,
+                    error="",
+                    # update() skips auto_now; restart the staleness clock
+                    updated_at=timezone.now(),
+                )
+            )
+            checkout.refresh_from_db()
+        if queued:
+            transaction.on_commit(lambda: tasks.place_order.delay(checkout.id))
+        return checkout
+
+
+class CheckoutSerializer(serializers.ModelSerializer):
+    order = OrderSerializer(read_only=True)
+
+    class Meta:
+        model = Checkout
+        fields = ["id", "cart_id", "status", "order", "error", "created_at"]
+
+
 class UpdateOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ["payment_status"]
+
+
+class ProductDailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductDailySales
+        fields = ["product", "date", "units", "revenue", "orders"]
+
+
+class CollectionDailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CollectionDailySales
+        fields = ["collection", "date", "units", "revenue", "orders"]
+
+
+class SalesTotalsSerializer(serializers.Serializer):
+    """Rollup rows summed over a date range, per product, collection or day."""
+
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    orders = serializers.IntegerField()
+    average_price = serializers.SerializerMethodField()
+
+    def __init__(self, *args, group_field, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields[group_field] = serializers.ReadOnlyField()
+
+    def get_average_price(self, row):
+        if not row["units"]:
+            return None
+        return (row["revenue"] / row["units"]).quantize(Decimal("0.01"))
+
+
+class BestSellerSerializer(serializers.ModelSerializer):
+    rank = serializers.IntegerField(read_only=True)
+    product = ProductSerializer(read_only=True)
+
+    class Meta:
+        model = BestSeller
+        fields = ["rank", "units", "revenue", "product"]
@@ -1,10 +1,127 @@
+import logging
+
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from store.models import Customer
+from store import analytics, cache, carts, pricing, search
+from store.models import (
+    CartItem,
+    Collection,
+    Customer,
+    Product,
+    ProductImage,
+    TaxRate,
+)
+from store.signals import order_created
+from store.tasks import process_product_image
+
+logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_profile_on_new_user(sender, **kwargs):
     if kwargs["created"]:
         Customer.objects.create(user=kwargs["instance"])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_catalog_cache(sender, **kwargs):
+    # after commit, so a concurrent read can't cache the old rows under the
+    # new version
+    transaction.on_commit(lambda: cache.invalidate(cache.CATALOG))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cart_summaries(sender, **kwargs):
+    # summaries total unit prices; after commit so none caches the old price
+    transaction.on_commit(lambda: cache.invalidate(carts.SUMMARIES))
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, **kwargs):
+    search.index_product(instance)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_summary(sender, instance, **kwargs):
+    carts.invalidate_summary(instance.cart_id)
+
+
+@receiver(post_save, sender=TaxRate)
+@receiver(post_delete, sender=TaxRate)
+def invalidate_tax_rates(sender, **kwargs):
+    # after commit, so no process reloads the old rates under the new version
+    transaction.on_commit(pricing.clear_cache)
+    transaction.on_commit(lambda: cache.invalidate(cache.CATALOG))
+
+
+def _adjust_products_count(collection_id, delta):
+    collections = Collection.objects.filter(pk=collection_id)
+    if delta < 0:
+        collections = collections.filter(products_count__gte=-delta)
+    collections.update(products_count=F("products_count") + delta)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_collection(sender, instance, **kwargs):
+    instance._previous_collection_id = (
+        Product.objects.filter(pk=instance.pk)
+        .values_list("collection_id", flat=True)
+        .first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_collection_id", None)
+    if created or previous is None:
+        _adjust_products_count(instance.collection_id, 1)
+    elif previous != instance.collection_id:
+        _adjust_products_count(previous, -1)
+        _adjust_products_count(instance.collection_id, 1)
+
+
+@receiver(post_delete, sender=Product)
+def count_deleted_product(sender, instance, **kwargs):
+    _adjust_products_count(instance.collection_id, -1)
+
+
+def _enqueue_product_image(image_id):
+    # runs after the image committed: a broker outage must not turn the
+    # upload into a 500; process_product_images renders what was missed
+    try:
+        process_product_image.delay(image_id)
+    except Exception:
+        logger.exception("Could not enqueue variants for product image %s", image_id)
+
+
+@receiver(post_save, sender=ProductImage)
+def process_new_product_image(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: _enqueue_product_image(instance.id))
+
+
+def _record_order_sales(order):
+    # runs after the order committed: an error here must not reach the client,
+    # and the nightly reconcile rebuilds any rollup this missed
+    try:
+        with transaction.atomic():
+            analytics.record_order(order)
+    except Exception:
+        logger.exception("Could not record sales rollups for order %s", order.pk)
+
+
+@receiver(order_created)
+def record_order_sales(sender, order, **kwargs):
+    transaction.on_commit(lambda: _record_order_sales(order))
@@ -0,0 +1,83 @@
+import logging
+
+from celery import shared_task
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from store import analytics, cache, carts, images, inventory, orders, serializers
+from store.models import Checkout, ProductImage
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def process_product_image(image_id):
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None or not image.image:
+        return
+    variants = images.render_variants(image.image.name)
+    # update() so the post_save handler does not enqueue this task again
+    ProductImage.objects.filter(pk=image_id).update(variants=variants)
+    cache.invalidate(cache.CATALOG)
+
+
+@shared_task
+def sweep_abandoned_carts():
+    return carts.delete_abandoned_carts()
+
+
+@shared_task
+def archive_orders():
+    return orders.archive_orders()
+
+
+@shared_task
+def reconcile_sales_rollups():
+    return analytics.reconcile()
+
+
+@shared_task
+def refresh_best_sellers():
+    return analytics.refresh_best_sellers()
+
+
+@shared_task
+def place_order(checkout_id):
+    try:
+        inventory.retry_on_deadlock(_place_order, checkout_id)
+    except Exception:
+        # the order's transaction rolled back with the status update, so
+        # record the failure on its own; posting the cart again retries it
+        logger.exception("Checkout %s failed", checkout_id)
+        Checkout.objects.filter(pk=checkout_id, status=Checkout.STATUS_PENDING).update(
+            status=Checkout.STATUS_FAILED,
+            error="The order could not be placed, try again.",
+        )
+        raise
+
+
+def _place_order(checkout_id):
+    # the checkout row is locked and finished in the order's transaction, so
+    # redelivered or duplicate tasks find it no longer pending and do nothing
+    with transaction.atomic():
+        checkout = (
+            Checkout.objects.select_for_update()
+            .select_related("customer")
+            .filter(pk=checkout_id, status=Checkout.STATUS_PENDING)
+            .first()
+        )
+        if checkout is None:
+            return
+        try:
+            checkout.order = serializers.CreateOrderSerializer().create_order(
+                checkout.cart_id, checkout.customer.user_id
+            )
+            checkout.status = Checkout.STATUS_COMPLETE
+        except inventory.InsufficientStock as error:
+            checkout.status = Checkout.STATUS_FAILED
+            checkout.error = " ".join(error.messages)
+        except ValidationError as error:
+            # create_order() reports a missing or empty cart as a list on cart_id
+            checkout.status = Checkout.STATUS_FAILED
+            checkout.error = " ".join(error.detail["cart_id"])
+        checkout.save()
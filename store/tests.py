@@ -1,3 +1,525 @@
-from django.test import TestCase
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+from urllib.parse import parse_qsl, urlsplit
+from uuid import uuid4
 
-# Create your tests here.
+from core.models import User
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from store import cache, carts, inventory, pricing, tasks
+from store.carts import CacheCartStorage, DatabaseCartStorage
+from store.models import (
+    ArchivedOrder,
+    Cart,
+    CartItem,
+    Checkout,
+    Collection,
+    Customer,
+    Order,
+    OrderItem,
+    Product,
+    ProductImage,
+    TaxRate,
+)
+from store.views import CartItemViewSet, OrderViewSet, ProductViewSet
+
+# tests that touch the store cache must never reach the configured Redis,
+# which also holds real carts and idempotency keys
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+def create_product(slug, collection=None, **fields):
+    """A product titled slug, in a new collection of the same name by default."""
+    if collection is None:
+        collection = Collection.objects.create(title=slug)
+    fields = {"title": slug, "unit_price": 1, "inventory": 10, **fields}
+    return Product.objects.create(slug=slug, collection=collection, **fields)
+
+
+def run_concurrently(worker, threads):
+    """Runs worker(i) on as many threads, each with its own connection."""
+
+    def run(i):
+        try:
+            return worker(i)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(run, range(threads)))
+
+
+# SQLite serializes writers and has no row locks, so these need MySQL or
+# PostgreSQL
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrencyTests(TransactionTestCase):
+    threads = 8
+
+    def setUp(self):
+        self.product = create_product("concurrency", inventory=20)
+
+    def test_concurrent_adds_lose_no_increments(self):
+        storage = DatabaseCartStorage()
+        cart = Cart.objects.create()
+        adds = 25
+
+        def worker(_):
+            for _ in range(adds):
+                storage.add_item(cart.id, self.product.id, 1)
+
+        run_concurrently(worker, self.threads)
+
+        item = CartItem.objects.get(cart=cart, product=self.product)
+        self.assertEqual(item.quantity, self.threads * adds)
+
+    def test_concurrent_reservations_never_oversell(self):
+        attempts = 5
+
+        def reserve_one():
+            with transaction.atomic():
+                inventory.reserve({self.product.id: 1})
+
+        def worker(_):
+            placed = 0
+            for _ in range(attempts):
+                try:
+                    inventory.retry_on_deadlock(reserve_one)
+                    placed += 1
+                except inventory.InsufficientStock:
+                    pass
+            return placed
+
+        placed = sum(run_concurrently(worker, self.threads))
+
+        self.product.refresh_from_db()
+        self.assertGreaterEqual(self.product.inventory, 0)
+        self.assertEqual(placed, 20)
+        self.assertEqual(self.product.inventory, 0)
+
+
+# pagination links are built from the request factory's testserver host
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class OrderQueryTests(TestCase):
+    """Reading orders takes the same number of queries at any page size."""
+
+    # orders + prefetched items (with their products)
+    queries = 2
+    page_sizes = [1, 10, 50]
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="queries")
+        # created one at a time: MySQL's bulk_create returns no primary keys
+        products = [
+            create_product(f"product-{i}", collection, unit_price=10, inventory=100)
+            for i in range(3)
+        ]
+        cls.staff = User.objects.create(
+            username="staff", email="staff@local", is_staff=True
+        )
+        cls.user = User.objects.create(username="customer", email="customer@local")
+        customer = Customer.objects.get(user=cls.user)
+        orders = [
+            Order.objects.create(customer=customer) for _ in range(max(cls.page_sizes))
+        ]
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=1, unit_price=10)
+            for order in orders
+            for product in products
+        )
+        cls.order = orders[0]
+
+    def get(self, user, action, params=None, **kwargs):
+        request = APIRequestFactory().get("/store/orders/", params or {})
+        force_authenticate(request, user)
+        response = OrderViewSet.as_view({"get": action})(request, **kwargs)
+        response.render()
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_list(self):
+        for user in [self.staff, self.user]:
+            for size in self.page_sizes:
+                with self.subTest(user=user.username, page_size=size):
+                    with self.assertNumQueries(self.queries):
+                        response = self.get(
+                            user, "list", {"cursor": "", "page_size": size}
+                        )
+                    self.assertEqual(len(response.data["results"]), size)
+
+    def test_detail(self):
+        for user in [self.staff, self.user]:
+            with self.subTest(user=user.username):
+                with self.assertNumQueries(self.queries):
+                    self.get(user, "retrieve", pk=self.order.pk)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CartSummaryTests(TestCase):
+    def test_only_product_changes_orphan_summaries(self):
+        cart_id = uuid4()
+        key = carts.summary_key(cart_id)
+
+        cache.invalidate(cache.CATALOG)
+        self.assertEqual(carts.summary_key(cart_id), key)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_product("summaries")
+        self.assertNotEqual(carts.summary_key(cart_id), key)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IdempotencyTests(TestCase):
+    """Idempotency-Key on cart item creation."""
+
+    def setUp(self):
+        self.product = create_product("idempotency")
+        self.cart = Cart.objects.create()
+
+    def post(self, data, key="key-1"):
+        request = APIRequestFactory().post(
+            f"/store/cart/{self.cart.id}/items/",
+            data,
+            format="json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+        response = CartItemViewSet.as_view({"post": "create"})(
+            request, cart_pk=str(self.cart.id)
+        )
+        response.render()
+        return response
+
+    def test_success_is_replayed(self):
+        data = {"product_id": self.product.id, "quantity": 1}
+        first = self.post(data)
+        second = self.post(data)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 1)
+
+    def test_different_body_is_rejected(self):
+        self.post({"product_id": self.product.id, "quantity": 1})
+        response = self.post({"product_id": self.product.id, "quantity": 2})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 1)
+
+    def test_key_is_released_after_client_error(self):
+        rejected = self.post({"product_id": 0, "quantity": 1})
+        accepted = self.post({"product_id": self.product.id, "quantity": 1})
+
+        self.assertEqual(rejected.status_code, 400)
+        self.assertEqual(accepted.status_code, 201)
+        self.assertFalse(accepted.has_header("Idempotent-Replayed"))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CartStorageTests(TestCase):
+    def setUp(self):
+        self.product = create_product("carts")
+
+    def test_set_quantity_on_removed_item(self):
+        for storage in [DatabaseCartStorage(), CacheCartStorage()]:
+            with self.subTest(storage=type(storage).__name__):
+                cart = storage.create_cart()
+                item = storage.add_item(cart.id, self.product.id, 1)
+                item = storage.get_item(cart.id, item.id)
+                storage.remove_item(storage.get_item(cart.id, item.id))
+
+                with self.assertRaises(CartItem.DoesNotExist):
+                    storage.set_quantity(item, 3)
+                self.assertEqual(list(storage.get_items(cart.id)), [])
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class KeysetPaginationTests(TestCase):
+    """Cursor round-trips over OrderViewSet, on ties in the sort column."""
+
+    page_size = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(
+            username="staff", email="staff@local", is_staff=True
+        )
+        cls.user = User.objects.create(username="customer", email="customer@local")
+        customer = Customer.objects.get(user=cls.user)
+        for total in [10, 20, 10, 30, 20, 10, 30, 20, 10, 20]:
+            Order.objects.create(customer=customer, total_price=total)
+
+        # archive every other order, keeping its id, with placed_at ties
+        # inside and across both tables
+        placed_at = timezone.now().replace(microsecond=0)
+        for i, order in enumerate(Order.objects.order_by("id")):
+            order.placed_at = placed_at - timedelta(days=i // 3)
+            if i % 2:
+                ArchivedOrder.objects.create(
+                    id=order.id,
+                    placed_at=order.placed_at,
+                    payment_status=order.payment_status,
+                    customer=customer,
+                    total_price=order.total_price,
+                    item_count=0,
+                )
+                order.delete()
+            else:
+                order.save()
+
+    def get(self, user, action, params):
+        request = APIRequestFactory().get("/store/orders/", params)
+        force_authenticate(request, user)
+        response = OrderViewSet.as_view({"get": action})(request)
+        response.render()
+        return response
+
+    def follow(self, user, action, link):
+        return self.get(user, action, dict(parse_qsl(urlsplit(link).query)))
+
+    def walk(self, user, action, params):
+        """Pages of ids following next links, then previous links back."""
+        response = self.get(user, action, {**params, "page_size": self.page_size})
+        forward = [[row["id"] for row in response.data["results"]]]
+        while response.data["next"]:
+            response = self.follow(user, action, response.data["next"])
+            forward.append([row["id"] for row in response.data["results"]])
+
+        backward = [forward[-1]]
+        while response.data["previous"]:
+            response = self.follow(user, action, response.data["previous"])
+            backward.append([row["id"] for row in response.data["results"]])
+        return forward, backward[::-1]
+
+    def test_round_trip_on_ties(self):
+        expected = list(
+            Order.objects.order_by("total_price", "id").values_list("id", flat=True)
+        )
+        forward, backward = self.walk(
+            self.staff, "list", {"cursor": "", "ordering": "total_price"}
+        )
+
+        self.assertEqual(sum(forward, []), expected)
+        self.assertTrue(all(len(page) == self.page_size for page in forward[:-1]))
+        self.assertEqual(backward, forward)
+
+    def test_tampered_cursor_is_not_found(self):
+        response = self.get(
+            self.staff,
+            "list",
+            {"cursor": "", "ordering": "total_price", "page_size": self.page_size},
+        )
+        cursor = dict(parse_qsl(urlsplit(response.data["next"]).query))["cursor"]
+        payload = json.loads(urlsafe_b64decode(cursor))
+        payload["o"] = ["-id"]
+        reordered = urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        payload = json.loads(urlsafe_b64decode(cursor))
+        payload["v"][0] = "not a price"
+        retyped = urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        for tampered in ["not-a-cursor", cursor[:-4], reordered, retyped]:
+            with self.subTest(cursor=tampered):
+                response = self.get(
+                    self.staff,
+                    "list",
+                    {"cursor": tampered, "ordering": "total_price"},
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_history_merges_recent_and_archived(self):
+        orders = [
+            (order.placed_at, order.id, archived)
+            for model, archived in [(Order, False), (ArchivedOrder, True)]
+            for order in model.objects.all()
+        ]
+        expected = [order_id for _, order_id, _ in sorted(orders, reverse=True)]
+        forward, backward = self.walk(self.user, "history", {})
+
+        self.assertEqual(sum(forward, []), expected)
+        self.assertEqual(backward, forward)
+        response = self.get(self.user, "history", {"page_size": len(expected)})
+        self.assertEqual(
+            [row["archived"] for row in response.data["results"]],
+            [archived for _, _, archived in sorted(orders, reverse=True)],
+        )
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], CACHES=LOCMEM_CACHES)
+class CatalogCacheTests(TestCase):
+    """Catalog changes bump the cache version, so the next read misses."""
+
+    def setUp(self):
+        cache.get_cache().clear()
+        pricing.clear_cache()
+        self.admin = User(username="admin", is_staff=True, is_superuser=True)
+        self.product = create_product("cache", title="Before", unit_price=10)
+
+    def get(self):
+        request = APIRequestFactory().get("/store/products/")
+        force_authenticate(request, self.admin)
+        response = ProductViewSet.as_view({"get": "list"})(request)
+        response.render()
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertRefreshed(self, change, field):
+        self.get()
+        primed = self.get()
+        self.assertEqual(primed["X-Cache"], "HIT")
+
+        change()
+        response = self.get()
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertNotEqual(
+            response.data["results"][0][field], primed.data["results"][0][field]
+        )
+
+    def test_product_save(self):
+        def change():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.title = "After"
+                self.product.save()
+
+        self.assertRefreshed(change, "title")
+
+    def test_image_save(self):
+        def change():
+            # the variants task is not under test, and needs the broker
+            with patch.object(tasks.process_product_image, "delay"):
+                with self.captureOnCommitCallbacks(execute=True):
+                    ProductImage.objects.create(
+                        product=self.product, image="store/images/dog.jpg"
+                    )
+
+        self.assertRefreshed(change, "images")
+
+    def test_tax_rate_save(self):
+        def change():
+            with self.captureOnCommitCallbacks(execute=True):
+                TaxRate.objects.create(rate="0.5")
+
+        self.assertRefreshed(change, "price_with_tax")
+
+    def test_stock_reservation_keeps_the_cache(self):
+        # checkouts must not orphan the catalog; stock may lag by the TTL
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve({self.product.id: 3})
+
+        self.assertEqual(self.get()["X-Cache"], "HIT")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TaxRateTests(TestCase):
+    def setUp(self):
+        pricing.clear_cache()
+
+    def test_change_in_another_process_is_picked_up(self):
+        TaxRate.objects.create(rate="0.2")
+        self.assertEqual(pricing.get_tax_rate(None), Decimal("0.2"))
+
+        # what another process's save does: new rows, then a version bump
+        # in the shared cache, without touching this process's copy
+        collection = Collection.objects.create(title="taxed")
+        TaxRate.objects.bulk_create([TaxRate(collection=collection, rate="0.3")])
+        cache.invalidate(pricing.TAX_RATES)
+
+        self.assertEqual(pricing.get_tax_rate(collection.id), Decimal("0.3"))
+
+    def test_half_cent_rounds_like_the_database(self):
+        TaxRate.objects.create(rate="0.1")
+        product = create_product("rounding", unit_price=Decimal("1.15"))
+        annotated = pricing.annotate_price_with_tax(Product.objects.all()).get(
+            pk=product.pk
+        )
+
+        self.assertEqual(annotated.price_with_tax, Decimal("1.27"))
+        self.assertEqual(
+            pricing.price_with_tax(product.unit_price, product.collection_id),
+            annotated.price_with_tax,
+        )
+
+    def test_single_default_rate(self):
+        TaxRate.objects.create(rate="0.2")
+        with self.assertRaises(IntegrityError):
+            TaxRate.objects.create(rate="0.3")
+
+
+class AsyncCheckoutTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="customer", email="customer@local")
+        self.customer = Customer.objects.get(user=user)
+
+    def place(self, cart_id):
+        checkout = Checkout.objects.create(cart_id=cart_id, customer=self.customer)
+        tasks.place_order(checkout.id)
+        checkout.refresh_from_db()
+        return checkout
+
+    def test_missing_cart_error(self):
+        checkout = self.place(uuid4())
+
+        self.assertEqual(checkout.status, Checkout.STATUS_FAILED)
+        self.assertEqual(checkout.error, "The cart does not exist with the given id.")
+
+    def test_empty_cart_error(self):
+        checkout = self.place(Cart.objects.create().id)
+
+        self.assertEqual(checkout.status, Checkout.STATUS_FAILED)
+        self.assertEqual(checkout.error, "The cart is empty.")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AbandonedCartTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title="abandoned")
+        self.products = [create_product(f"abandoned-{i}", collection) for i in range(5)]
+
+    def create_carts(self, count):
+        for _ in range(count):
+            cart = Cart.objects.create()
+            CartItem.objects.bulk_create(
+                CartItem(cart=cart, product=product, quantity=1)
+                for product in self.products
+            )
+        Cart.objects.update(created_at=timezone.now() - timedelta(days=30))
+
+    def test_sweep_queries_do_not_grow_with_items(self):
+        for carts_count in [1, 20]:
+            with self.subTest(carts=carts_count):
+                self.create_carts(carts_count)
+                # ids, savepoint, lock, items, carts, release, empty ids
+                with self.assertNumQueries(7):
+                    stats = carts.delete_abandoned_carts(max_age=60, batch_size=50)
+
+                self.assertEqual(stats["carts"], carts_count)
+                self.assertEqual(stats["items"], carts_count * 5)
+                self.assertFalse(Cart.objects.exists())
+                self.assertFalse(CartItem.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductImageTests(TestCase):
+    def test_broker_outage_does_not_fail_the_upload(self):
+        product = create_product("images")
+        delay = patch.object(
+            tasks.process_product_image, "delay", side_effect=ConnectionError
+        )
+        with delay, self.assertLogs("store.signals.handlers", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                image = ProductImage.objects.create(
+                    product=product, image="store/images/dog.jpg"
+                )
+
+        self.assertTrue(ProductImage.objects.filter(pk=image.pk).exists())
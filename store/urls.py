@@ -13,6 +13,15 @@ router.register("products", views.ProductViewSet, basename="products")
 router.register("collections", views.CollectionViewSet)
 router.register("cart", views.CartViewSet)
 router.register("orders", views.OrderViewSet, basename="orders")
+router.register("checkouts", views.CheckoutViewSet, basename="checkouts")
+router.register(
+    "analytics/products", views.ProductSalesViewSet, basename="analytics-products"
+)
+router.register(
+    "analytics/collections",
+    views.CollectionSalesViewSet,
+    basename="analytics-collections",
+)
 router.register("customers", views.CustomerViewSet, basename="customers")
 
 product_router = routers.NestedDefaultRouter(router, "products", lookup="product")
@@ -1,14 +1,17 @@
+from django.conf import settings
 from django.db import transaction
-from django.db.models.aggregates import Count
+from django.db.models.aggregates import Sum
 from django.db.models.base import Model
+from django.http import Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.conf import User
 from rest_framework import permissions, status
 from rest_framework.decorators import action, permission_classes
-from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.mixins import (
     CreateModelMixin,
     DestroyModelMixin,
+    ListModelMixin,
     RetrieveModelMixin,
     UpdateModelMixin,
 )
@@ -19,58 +22,137 @@ from rest_framework.permissions import (
     IsAuthenticatedOrReadOnly,
 )
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.serializers import ModelSerializer
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
-from store import serializers
-from store.filters import ProductFilter
-from store.pagination import DefaultPagination
+from store import analytics, bulk, cache, facets, pricing, serializers
+from store.cache import CachedResponseMixin
+from store.carts import get_cart_storage, get_cart_summary, with_totals
+from store.filters import (
+    CollectionSalesFilter,
+    CustomerFilter,
+    OrderFilter,
+    ProductFilter,
+    ProductSalesFilter,
+    ProductSearchFilter,
+)
+from store.idempotency import idempotent
+from store.pagination import (
+    CatalogPagination,
+    DefaultPagination,
+    KeysetPagination,
+    MergedKeysetPagination,
+)
 from store.permissions import IsAdminOrReadOnly, ViewHistoryPermission
 
 from .models import (
+    ArchivedOrder,
+    ArchivedOrderItem,
+    BestSeller,
     Cart,
-    CartItem,
+    Checkout,
     Collection,
+    CollectionDailySales,
     Customer,
     Order,
     OrderItem,
     Product,
+    ProductDailySales,
     ProductImage,
     Reviews,
 )
 from .serializers import (
     AddCartItemSerializer,
+    BatchCartItemSerializer,
+    BestSellerSerializer,
     CartItemSerializer,
     CartSerializer,
+    CheckoutSerializer,
+    CollectionDailySalesSerializer,
     CollectionSerializer,
+    CreateCheckoutSerializer,
     CreateOrderSerializer,
     CustomerProfileSerializer,
     CustomerSerializer,
+    OrderHistorySerializer,
     OrderSerializer,
+    ProductDailySalesSerializer,
     ProductImageSerializer,
+    ProductRowSerializer,
     ProductSerializer,
     ReviewSerializer,
+    SalesTotalsSerializer,
     UpdateCartItemSerializer,
     UpdateOrderSerializer,
+    order_items_prefetch,
 )
 
 # Create your views here.
 
 
+class FastListMixin:
+    """
+    Serves list requests from values() rows through
+    fast_list_serializer_class, skipping model instances and DRF field
+    machinery. Opt-in: it only runs when the STORE_FAST_LIST setting is on,
+    otherwise (or with no fast serializer) the regular serializer is used.
+    """
+
+    fast_list_serializer_class = None
+
+    def use_fast_list(self):
+        return self.fast_list_serializer_class is not None and getattr(
+            settings, "STORE_FAST_LIST", False
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list():
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        rows = queryset.values(*self.get_fast_list_columns(queryset))
+        page = self.paginate_queryset(rows)
+        serializer = self.fast_list_serializer_class(
+            page if page is not None else rows,
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    def get_fast_list_columns(self, queryset):
+        """
+        Every column unless only() narrowed the queryset, in which case the
+        effective ordering fields and id (needed by keyset cursors) and
+        annotations are kept.
+        """
+        names, deferred = queryset.query.deferred_loading
+        if deferred or not names:
+            return []
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        ordering = [field.lstrip("-") for field in ordering]
+        columns = [*names, *ordering, "id", *queryset.query.annotations]
+        return list(dict.fromkeys(columns))
+
+
 """
 class ProductViewSet - Inherited from ModelViewSet Generic Views
 HTTP Requests supported: GET, POST, PUT, DELETE
 """
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(CachedResponseMixin, FastListMixin, ModelViewSet):
     queryset = Product.objects.prefetch_related("images").all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    fast_list_serializer_class = ProductRowSerializer
+    max_batch_size = 100
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     # filterset_fields = ["collection_id", "unit_price"]
     filterset_class = ProductFilter
     search_fields = ["title", "description"]
-    ordering_fields = ["unit_price", "last_update"]
+    ordering_fields = ["unit_price", "price_with_tax", "last_update"]
     # permission_classes = [IsAdminOrReadOnly]
     permission_classes = [DjangoModelPermissions]
     """
@@ -81,12 +163,141 @@ class ProductViewSet(ModelViewSet):
     """
     Pagination can also be set up globally in settings module.
     Please check the settings.py module in storefront folder.
+    Page numbers by default, keyset pagination when ?cursor= is given.
     """
-    pagination_class = DefaultPagination
+    pagination_class = CatalogPagination
+
+    def get_queryset(self):
+        queryset = pricing.annotate_price_with_tax(super().get_queryset())
+        return ProductSerializer.optimize_queryset(queryset, self.request)
 
     def get_serializer_context(self):
         return {"request": self.request}
 
+    def paginate_queryset(self, queryset):
+        # ?facets= counts are computed from the filtered, unpaginated queryset
+        self.facets = facets.get_facets(self.request, queryset)
+        return super().paginate_queryset(queryset)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.facets is not None:
+            response.data["facets"] = self.facets
+        return response
+
+    @action(detail=False, methods=["GET", "POST"], permission_classes=[IsAdminUser])
+    def bulk(self, request):
+        """
+        GET streams the whole catalog (?type=csv, NDJSON by default).
+        POST upserts products by slug from an NDJSON or text/csv body.
+        """
+        if request.method == "GET":
+            if request.query_params.get("type") == "csv":
+                return StreamingHttpResponse(bulk.export_csv(), content_type="text/csv")
+            return StreamingHttpResponse(
+                bulk.export_ndjson(), content_type="application/x-ndjson"
+            )
+        rows = bulk.read_rows(request.stream or [], request.content_type)
+        return Response(bulk.import_products(rows))
+
+    @action(detail=False, url_path="best-sellers")
+    def best_sellers(self, request):
+        """
+        Top products by units sold over ?window= days (one of
+        STORE_BEST_SELLER_WINDOWS, the first by default), overall or in
+        ?collection=, read from the precomputed ranking and cached.
+        """
+        windows = analytics.get_best_seller_windows()
+        try:
+            window = int(request.query_params.get("window", windows[0]))
+            collection_id = request.query_params.get("collection")
+            collection_id = int(collection_id) if collection_id else None
+        except ValueError:
+            window = None
+        if window not in windows:
+            return Response(
+                {"error": f"window must be one of {windows} and collection an id."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # rankings change on refresh, product data on catalog changes
+        key = "{}:{}".format(
+            cache.make_key(request, analytics.BEST_SELLERS),
+            cache.get_version(cache.CATALOG),
+        )
+        data = cache.get_cache().get(key)
+        if data is not None:
+            return Response(data, headers={"X-Cache": "HIT"})
+
+        queryset = (
+            BestSeller.objects.filter(window=window, collection_id=collection_id)
+            .select_related("product")
+            .prefetch_related("product__images")
+            .order_by("-units", "product_id")
+        )
+        paginator = DefaultPagination()
+        page = paginator.paginate_queryset(queryset, request, self)
+        first_rank = paginator.page.start_index()
+        for rank, best_seller in enumerate(page, first_rank):
+            best_seller.rank = rank
+        serializer = BestSellerSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        data = paginator.get_paginated_response(serializer.data).data
+        timeout = getattr(settings, "STORE_BEST_SELLERS_CACHE_TIMEOUT", 60)
+        cache.get_cache().set(key, data, timeout)
+        return Response(data, headers={"X-Cache": "MISS"})
+
+    @action(detail=False)
+    def batch(self, request):
+        """
+        Looks up ?ids=1,2,3 in one query (plus one images prefetch), in
+        request order. Ids that do not exist are listed under missing.
+        """
+        try:
+            ids = list(
+                dict.fromkeys(
+                    int(id) for id in request.query_params.get("ids", "").split(",")
+                )
+            )
+        except ValueError:
+            return Response(
+                {"error": "ids must be a comma separated list of integers."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(ids) > self.max_batch_size:
+            return Response(
+                {"error": f"At most {self.max_batch_size} ids can be requested."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        timeout = getattr(settings, "STORE_PRODUCT_CACHE_TIMEOUT", None)
+        found, keys = {}, {}
+        if timeout:
+            keys = cache.make_object_keys(request, ids)
+            cached = cache.get_cache().get_many(keys.values())
+            found = {id: cached[key] for id, key in keys.items() if key in cached}
+
+        pending = [id for id in ids if id not in found]
+        if pending:
+            products = list(self.get_queryset().filter(pk__in=pending))
+            serializer = self.get_serializer(products, many=True)
+            loaded = {
+                product.id: data for product, data in zip(products, serializer.data)
+            }
+            if timeout and loaded:
+                cache.get_cache().set_many(
+                    {keys[id]: product for id, product in loaded.items()}, timeout
+                )
+            found.update(loaded)
+
+        return Response(
+            {
+                "results": [found[id] for id in ids if id in found],
+                "missing": [id for id in ids if id not in found],
+            }
+        )
+
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs["id"]).count() > 0:
             return Response(
@@ -104,8 +315,8 @@ HTTP Requests supported: GET, POST, PUT, DELETE
 """
 
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(products_count=Count("products")).all()
+class CollectionViewSet(CachedResponseMixin, ModelViewSet):
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
     permission_classes = [IsAdminOrReadOnly]
 
@@ -122,6 +333,7 @@ class CollectionViewSet(ModelViewSet):
 
 class ReviewViewSet(ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return Reviews.objects.filter(product_id=self.kwargs["product_pk"])
@@ -133,13 +345,39 @@ class ReviewViewSet(ModelViewSet):
 class CartViewSet(
     CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet
 ):
-    queryset = Cart.objects.prefetch_related("items__product").all()
+    queryset = with_totals(Cart.objects.all())
     serializer_class = CartSerializer
 
+    def get_queryset(self):
+        return CartSerializer.optimize_queryset(super().get_queryset(), self.request)
+
+    def get_object(self):
+        cart = get_cart_storage().get_cart(self.kwargs["pk"], self.get_queryset())
+        if cart is None:
+            raise Http404
+        return cart
+
+    def perform_create(self, serializer):
+        serializer.instance = get_cart_storage().create_cart()
+
+    def perform_destroy(self, instance):
+        get_cart_storage().delete_cart(instance.id)
+
+    @action(detail=True)
+    def summary(self, request, pk=None):
+        """Item count and total for the cart badge, without the items."""
+        summary = get_cart_summary(pk)
+        if summary is None:
+            raise Http404
+        return Response(summary)
+
 
 class CustomerViewSet(ModelViewSet):
-    queryset = Customer.objects.all()
+    queryset = Customer.objects.select_related("user").all()
     serializer_class = CustomerSerializer
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = CustomerFilter
+    ordering_fields = ["order_count", "lifetime_spend", "last_order_at"]
 
     permission_classes = [IsAdminUser]
 
@@ -170,9 +408,34 @@ class CartItemViewSet(ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete"]
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs["cart_pk"]).select_related(
-            "product"
+        return get_cart_storage().get_items(self.kwargs["cart_pk"])
+
+    def get_object(self):
+        item = get_cart_storage().get_item(self.kwargs["cart_pk"], self.kwargs["pk"])
+        if item is None:
+            raise Http404
+        return item
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        get_cart_storage().remove_item(instance)
+
+    @action(detail=False, methods=["POST"])
+    def batch(self, request, cart_pk=None):
+        """
+        Applies a list of add/set/remove operations in one transaction and
+        returns the resulting cart.
+        """
+        serializer = BatchCartItemSerializer(
+            data=request.data, context=self.get_serializer_context()
         )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        cart = get_cart_storage().get_cart(cart_pk, with_totals(Cart.objects.all()))
+        return Response(CartSerializer(cart, context={"request": request}).data)
 
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -188,6 +451,10 @@ class CartItemViewSet(ModelViewSet):
 class OrderViewSet(ModelViewSet):
 
     http_method_names = ["get", "patch", "post", "delete", "head", "options"]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = OrderFilter
+    ordering_fields = ["placed_at", "total_price", "item_count"]
 
     def get_permissions(self):
         if self.request.method in ["PATCH", "DELETE"]:
@@ -202,29 +469,73 @@ class OrderViewSet(ModelViewSet):
         return OrderSerializer
 
     def get_serializer_context(self):
-        return {"user_id": self.request.user.id}
+        return {"user_id": self.request.user.id, "request": self.request}
 
     def get_queryset(self):
         user = self.request.user
-        if user.is_staff:
-            return Order.objects.all()
-        customer = Customer.objects.get(user_id=user.id)
-        return (
-            Order.objects.prefetch_related("items")
-            .select_related("customer")
-            .filter(customer_id=customer.id)
-            .all()
+        # the whole order graph in two queries, whatever the page size
+        queryset = Order.objects.select_related("customer__user").prefetch_related(
+            order_items_prefetch()
         )
+        if not user.is_staff:
+            queryset = queryset.filter(customer__user_id=user.id)
+        return OrderSerializer.optimize_queryset(queryset, self.request)
 
+    @action(detail=False)
+    def history(self, request):
+        """
+        The customer's orders, recent and archived, newest first, with
+        cursor pagination. Other order endpoints only read recent orders.
+        """
+        querysets = [
+            model.objects.filter(customer__user_id=request.user.id)
+            .select_related("customer__user")
+            .prefetch_related(order_items_prefetch(model=item_model))
+            .order_by("-placed_at", "-id")
+            for model, item_model in [
+                (Order, OrderItem),
+                (ArchivedOrder, ArchivedOrderItem),
+            ]
+        ]
+        paginator = MergedKeysetPagination()
+        page = paginator.paginate_queryset(querysets, request, self)
+        serializer = OrderHistorySerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @idempotent
     def create(self, request, *args, **kwargs):
+        if self.use_async_checkout(request):
+            return self.create_checkout(request)
         serializer = CreateOrderSerializer(
             data=request.data, context=self.get_serializer_context()
         )
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
-        serializer = OrderSerializer(order)
+        serializer = OrderSerializer(self.get_queryset().get(pk=order.pk))
         return Response(serializer.data)
 
+    def use_async_checkout(self, request):
+        """STORE_ASYNC_CHECKOUT, or per request with Prefer: respond-async."""
+        prefer = request.headers.get("Prefer", "")
+        return getattr(settings, "STORE_ASYNC_CHECKOUT", False) or (
+            "respond-async" in prefer
+        )
+
+    def create_checkout(self, request):
+        serializer = CreateCheckoutSerializer(
+            data=request.data, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        checkout = serializer.save()
+        location = reverse("checkouts-detail", args=[checkout.id], request=request)
+        return Response(
+            CheckoutSerializer(checkout).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": location},
+        )
+
     def destroy(self, request, *args, **kwargs):
         with transaction.atomic():
             instance = self.get_object()
@@ -235,6 +546,21 @@ class OrderViewSet(ModelViewSet):
             return Response(order, status=status.HTTP_200_OK)
 
 
+class CheckoutViewSet(RetrieveModelMixin, GenericViewSet):
+    """Status of an asynchronous checkout: pending, complete or failed."""
+
+    serializer_class = CheckoutSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = Checkout.objects.select_related(
+            "order__customer__user"
+        ).prefetch_related(order_items_prefetch("order__items"))
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(customer__user_id=self.request.user.id)
+        return queryset
+
+
 class ProductImageViewSet(ModelViewSet):
     serializer_class = ProductImageSerializer
 
@@ -243,3 +569,56 @@ class ProductImageViewSet(ModelViewSet):
 
     def get_serializer_context(self):
         return {"product_id": self.kwargs["product_pk"]}
+
+
+class SalesAnalyticsViewSet(ListModelMixin, GenericViewSet):
+    """
+    Staff sales analytics from the daily rollup tables (store.analytics),
+    so each query scans days rather than order items. Filter with
+    ?since=&until= (dates, inclusive).
+
+    list: the daily rows. totals: summed per product or collection,
+    best revenue first. daily: summed per day, across the filtered rows.
+    """
+
+    permission_classes = [IsAdminUser]
+    filter_backends = [DjangoFilterBackend]
+    pagination_class = CatalogPagination
+    group_field = None
+
+    def get_queryset(self):
+        return self.queryset.order_by("-date", "-id")
+
+    def summed(self, group_by, ordering):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = (
+            queryset.values(group_by)
+            .annotate(units=Sum("units"), revenue=Sum("revenue"), orders=Sum("orders"))
+            .order_by(*ordering)
+        )
+        paginator = DefaultPagination()
+        page = paginator.paginate_queryset(rows, self.request, self)
+        serializer = SalesTotalsSerializer(page, many=True, group_field=group_by)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def totals(self, request):
+        return self.summed(self.group_field, ["-revenue", self.group_field])
+
+    @action(detail=False)
+    def daily(self, request):
+        return self.summed("date", ["-date"])
+
+
+class ProductSalesViewSet(SalesAnalyticsViewSet):
+    queryset = ProductDailySales.objects.all()
+    serializer_class = ProductDailySalesSerializer
+    filterset_class = ProductSalesFilter
+    group_field = "product"
+
+
+class CollectionSalesViewSet(SalesAnalyticsViewSet):
+    queryset = CollectionDailySales.objects.all()
+    serializer_class = CollectionDailySalesSerializer
+    filterset_class = CollectionSalesFilter
+    group_field = "collection"
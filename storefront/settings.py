@@ -2,6 +2,9 @@ from datetime import timedelta
 from os import path
 from pathlib import Path
 
+from celery.schedules import crontab
+from corsheaders.defaults import default_headers
+
 """
 Django settings for storefront project.
 
@@ -76,6 +79,7 @@ INTERNAL_IPS = [
 ]
 
 CORS_ALLOWED_ORIGINS = ["http://localhost:8001", "http://127.0.0.1:8001"]
+CORS_ALLOW_HEADERS = list(default_headers) + ["idempotency-key", "prefer"]
 
 ROOT_URLCONF = "storefront.urls"
 
@@ -189,3 +193,100 @@ ADMINS = [("Zahid", "zahid@tech-foundry.com")]
 
 CELERY_BROKER_URL = "redis://localhost:6379/1"
 
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://localhost:6379/2",
+    }
+}
+
+# Cache alias and TTL (seconds) used by store.cache for catalog responses
+STORE_CACHE_ALIAS = "default"
+STORE_RESPONSE_CACHE_TIMEOUT = 5 * 60
+
+# Serve product lists from values() rows through ProductRowSerializer instead
+# of ProductSerializer (see store.views.FastListMixin)
+STORE_FAST_LIST = False
+
+# Used when no default TaxRate row exists; each process reloads its cached rates
+# when a TaxRate changes, or after this many seconds
+STORE_DEFAULT_TAX_RATE = "0.1"
+STORE_TAX_RATE_CACHE_TIMEOUT = 60
+
+# Resized product image variants (max width, height) and the formats rendered
+STORE_IMAGE_VARIANTS = {
+    "thumbnail": (150, 150),
+    "card": (400, 400),
+    "full": (1200, 1200),
+}
+STORE_IMAGE_FORMATS = ["WEBP", "JPEG"]
+
+# Per-product cache used by /store/products/batch/ (seconds, None disables it)
+STORE_PRODUCT_CACHE_TIMEOUT = 5 * 60
+
+# Upper bounds of the unit_price buckets returned by ?facets=price
+STORE_PRICE_FACET_EDGES = [10, 25, 50, 100]
+
+# Cart engine: store.carts.DatabaseCartStorage, or store.carts.CacheCartStorage
+# to keep carts in the cache (with a sliding TTL in seconds) until checkout
+STORE_CART_STORAGE = "store.carts.DatabaseCartStorage"
+STORE_CART_TTL = 7 * 24 * 60 * 60
+# Per-cart lock for cache cart changes: expiry, and how long a writer waits
+# for it before the request gets 409 (seconds)
+STORE_CART_LOCK_TIMEOUT = 10
+STORE_CART_LOCK_WAIT = 5
+
+# Cart summary (item count and total) cache, in seconds
+STORE_CART_SUMMARY_TIMEOUT = 5 * 60
+
+# Abandoned carts: Cart rows older than STORE_ABANDONED_CART_AGE seconds are
+# deleted hourly by store.tasks.sweep_abandoned_carts, in batches
+STORE_ABANDONED_CART_AGE = 14 * 24 * 60 * 60
+STORE_CART_SWEEP_BATCH_SIZE = 500
+
+CELERY_BEAT_SCHEDULE = {
+    "sweep_abandoned_carts": {
+        "task": "store.tasks.sweep_abandoned_carts",
+        "schedule": 60 * 60,
+    },
+    "archive_orders": {
+        "task": "store.tasks.archive_orders",
+        "schedule": 24 * 60 * 60,
+    },
+    "reconcile_sales_rollups": {
+        "task": "store.tasks.reconcile_sales_rollups",
+        "schedule": crontab(hour=2, minute=0),
+    },
+    "refresh_best_sellers": {
+        "task": "store.tasks.refresh_best_sellers",
+        "schedule": 10 * 60,
+    },
+}
+
+# Checkout retries after a deadlock, with exponential backoff from this many seconds
+STORE_CHECKOUT_RETRIES = 3
+STORE_CHECKOUT_RETRY_BACKOFF = 0.05
+
+# Place orders in a Celery task and answer checkout with 202 and a status URL.
+# Clients can opt in per request with the "Prefer: respond-async" header.
+STORE_ASYNC_CHECKOUT = False
+# Posting a cart whose checkout has been pending this long (seconds) queues it again
+STORE_CHECKOUT_STALE_AFTER = 10 * 60
+
+# Completed orders older than STORE_ORDER_ARCHIVE_AGE days move to the archive
+# tables daily (store.tasks.archive_orders), in batches
+STORE_ORDER_ARCHIVE_AGE = 365
+STORE_ORDER_ARCHIVE_BATCH_SIZE = 500
+
+# Best sellers: ranking windows in days, ranking length and response cache TTL
+STORE_BEST_SELLER_WINDOWS = [7, 30]
+STORE_BEST_SELLERS_SIZE = 100
+STORE_BEST_SELLERS_CACHE_TIMEOUT = 60
+
+# Idempotency-Key on checkout and cart item POSTs: how long responses are
+# replayed, how long a duplicate waits for the first request, and how long
+# a key stays claimed after its worker stops refreshing it
+STORE_IDEMPOTENCY_TTL = 24 * 60 * 60
+STORE_IDEMPOTENCY_WAIT = 10
+STORE_IDEMPOTENCY_CLAIM_TIMEOUT = 60